@@ -0,0 +1,54 @@
+"""Recall@k / latency report for the IVF index.
+
+Run from the chatbot_backend directory:
+
+    python -m benchmarks.ann_recall                  # vectors from MongoDB
+    python -m benchmarks.ann_recall --synthetic 200000
+"""
+import argparse
+import numpy as np
+from modules.ann_index import IVFIndex, recall_report
+from modules.vector_index import EMBEDDING_DIM
+
+
+def synthetic_vectors(n, dim, clusters=500, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return centers[rng.integers(clusters, size=n)] + 0.6 * rng.normal(size=(n, dim))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random clustered vectors instead of MongoDB")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    index = IVFIndex(nlist=args.nlist)
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, EMBEDDING_DIM)
+        index.add(list(range(len(vectors))), vectors)
+    else:
+        from modules.database import get_collection
+        index.load(get_collection())
+    index.wait_for_training()
+    if not index.trained:
+        index.train()
+
+    # Perturbed copies of stored vectors stand in for real questions
+    rng = np.random.default_rng(1)
+    sample = index._buffer[rng.choice(len(index), min(args.queries, len(index)), replace=False)]
+    queries = sample + 0.05 * rng.normal(size=sample.shape)
+
+    sizes = index.list_sizes()
+    print(f"vectors={len(index)} nlist={len(sizes)} max_list={max(sizes, default=0)}")
+    print(f"{'nprobe':>8} {'recall@' + str(args.k):>10} {'ivf ms':>10} {'exact ms':>10}")
+    for row in recall_report(index, queries, k=args.k, nprobe_values=args.nprobe):
+        print(f"{row['nprobe']:>8} {row['recall_at_k']:>10.3f} "
+              f"{row['latency_ms']:>10.3f} {row['exact_latency_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Latency of session listing and lookup as the number of chat sessions grows.
+
+Fills a scratch chat_sessions collection in <DATABASE_NAME>_bench (dropped
+afterwards) with the production indexes, then times the first page and a
+deep keyset page of one owner's sessions and a lookup by session_id at each
+size. Run from the chatbot_backend directory:
+
+    python -m benchmarks.chat_sessions --sizes 10000 100000 1000000
+"""
+import argparse
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from modules.database import get_mongo_client, DATABASE_NAME
+from modules.chat_store import (
+    session_list_query, encode_session_cursor, SESSION_LIST_PROJECTION, SESSION_LIST_SORT
+)
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(1000 * (time.perf_counter() - start))
+    return statistics.median(samples)
+
+
+def fill(collection, start, end, owners, batch_size=10000):
+    base = datetime(2024, 1, 1)
+    for batch_start in range(start, end, batch_size):
+        collection.insert_many([
+            {
+                "session_id": str(uuid.uuid4()),
+                "owner": f"owner-{i % owners}",
+                "title": f"Session {i}",
+                "message_count": 0,
+                "created_at": base + timedelta(seconds=i),
+                "updated_at": base + timedelta(seconds=i),
+            }
+            for i in range(batch_start, min(batch_start + batch_size, end))
+        ], ordered=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--owners", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    collection = get_mongo_client()[f"{DATABASE_NAME}_bench"]["chat_sessions"]
+    collection.drop()
+    collection.create_index("session_id", unique=True)
+    collection.create_index([("owner", 1), ("updated_at", -1), ("session_id", -1)])
+
+    print(f"{'sessions':>10} {'page 1 ms':>10} {'page 5 ms':>10} {'lookup ms':>10} {'examined':>9}")
+    try:
+        filled = 0
+        for size in sorted(args.sizes):
+            fill(collection, filled, size, args.owners)
+            filled = size
+            owner = "owner-0"
+
+            def first_page():
+                return list(collection.find(session_list_query(owner), SESSION_LIST_PROJECTION)
+                            .sort(SESSION_LIST_SORT).limit(args.page_size + 1))
+
+            # Walk to the fifth page through cursors, as a client scrolling back would
+            cursor = None
+            for _ in range(4):
+                page = list(collection.find(session_list_query(owner, cursor), SESSION_LIST_PROJECTION)
+                            .sort(SESSION_LIST_SORT).limit(args.page_size))
+                if not page:
+                    break
+                cursor = encode_session_cursor(page[-1])
+
+            def deep_page():
+                return list(collection.find(session_list_query(owner, cursor), SESSION_LIST_PROJECTION)
+                            .sort(SESSION_LIST_SORT).limit(args.page_size + 1))
+
+            target = collection.find_one({}, {"session_id": 1, "owner": 1}, skip=size // 2)
+
+            def lookup():
+                return collection.find_one({"session_id": target["session_id"], "owner": target["owner"]})
+
+            plan = collection.find(session_list_query(owner, cursor)).sort(SESSION_LIST_SORT) \
+                .limit(args.page_size + 1).explain()
+            examined = plan["executionStats"]["totalDocsExamined"]
+            print(f"{size:>10} {timed(first_page, args.repeat):>10.2f} {timed(deep_page, args.repeat):>10.2f} "
+                  f"{timed(lookup, args.repeat):>10.2f} {examined:>9}")
+    finally:
+        collection.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Concurrency check for /ask/: N parallel requests should take ~max(latency), not sum(latency).
+
+Start the API first, then run from the chatbot_backend directory:
+
+    python -m benchmarks.concurrent_ask --url http://127.0.0.1:8000 -n 10
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+QUESTIONS = [
+    "Is chocolate toxic to dogs?",
+    "What are the symptoms of parvovirus?",
+    "How often should cats be vaccinated?",
+    "What causes kennel cough?",
+    "Can rabbits eat lettuce?",
+]
+
+
+def ask(url, question):
+    start = time.perf_counter()
+    response = requests.post(f"{url}/ask/", data={"question": question}, timeout=300)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("-n", type=int, default=10, help="number of parallel requests")
+    args = parser.parse_args()
+
+    # Distinct questions per request so caches do not hide the concurrency behaviour
+    questions = [f"{QUESTIONS[i % len(QUESTIONS)]} (request {i})" for i in range(args.n)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.n) as pool:
+        latencies = list(pool.map(lambda q: ask(args.url, q), questions))
+    wall = time.perf_counter() - start
+
+    print(f"requests={args.n}")
+    print(f"wall clock     {wall:8.2f}s")
+    print(f"max latency    {max(latencies):8.2f}s")
+    print(f"sum latency    {sum(latencies):8.2f}s")
+    print(f"wall / max     {wall / max(latencies):8.2f}  (~1.0 means requests overlapped)")
+
+
+if __name__ == "__main__":
+    main()
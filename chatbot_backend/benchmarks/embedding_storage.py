@@ -0,0 +1,64 @@
+"""Compare embedding storage formats: collection size, load time and recall@k.
+
+Writes the same vectors in each format to scratch collections in
+<DATABASE_NAME>_bench (dropped afterwards). Run from the chatbot_backend directory:
+
+    python -m benchmarks.embedding_storage -n 20000
+"""
+import argparse
+import time
+import numpy as np
+from modules.database import get_mongo_client, DATABASE_NAME
+from modules.vector_codec import encode_embedding, decode_embedding, EMBEDDING_PROJECTION
+from modules.vector_index import VectorIndex, EMBEDDING_DIM
+
+FORMATS = ["array", "float16", "int8"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=20000, help="number of vectors")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(args.n, EMBEDDING_DIM)).astype(np.float32)
+    queries = vectors[rng.choice(args.n, args.queries, replace=False)] + 0.3 * rng.normal(size=(args.queries, EMBEDDING_DIM))
+
+    exact = VectorIndex()
+    exact.add(list(range(args.n)), vectors)
+    truth = [{i for i, _ in exact.search(q, args.k)} for q in queries]
+
+    db = get_mongo_client()[f"{DATABASE_NAME}_bench"]
+    print(f"{'format':>8} {'size MiB':>10} {'storage MiB':>12} {'load s':>8} {'recall@' + str(args.k):>10}")
+    for storage in FORMATS:
+        collection = db[f"embeddings_{storage}"]
+        collection.drop()
+        for start in range(0, args.n, 1000):
+            collection.insert_many([
+                {"_id": i, "content": "", **encode_embedding(vectors[i], storage)}
+                for i in range(start, min(start + 1000, args.n))
+            ])
+        stats = db.command("collStats", collection.name)
+
+        start = time.perf_counter()
+        index = VectorIndex()
+        index.load(collection)
+        load_seconds = time.perf_counter() - start
+
+        hits = sum(len(expected & {i for i, _ in index.search(q, args.k)}) for expected, q in zip(truth, queries))
+        recall = hits / (args.k * len(queries))
+        print(f"{storage:>8} {stats['size'] / 2**20:>10.1f} {stats['storageSize'] / 2**20:>12.1f} "
+              f"{load_seconds:>8.2f} {recall:>10.3f}")
+        collection.drop()
+
+    # Sanity check: decode round trip error per format
+    sample = vectors[0]
+    for storage in FORMATS:
+        decoded = decode_embedding(encode_embedding(sample, storage))
+        print(f"{storage:>8} max abs round-trip error {np.abs(decoded - sample).max():.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Hit rate / latency of vector-only vs hybrid (BM25 + vector, RRF) retrieval.
+
+Run from the chatbot_backend directory:
+
+    python -m benchmarks.hybrid_retrieval --labels queries.json   # corpus from MongoDB
+    python -m benchmarks.hybrid_retrieval --synthetic 100000
+
+The labels file is a JSON list of {"query": ..., "source": ...} objects; a
+query is a hit when a chunk of the expected source is in the top k.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from modules.bm25_index import BM25Index, hybrid_search
+from modules.vector_index import EMBEDDING_DIM, VectorIndex
+
+
+def synthetic_corpus(n, vocabulary=50000, words_per_chunk=120, seed=0):
+    """Random chunks over a Zipf-distributed vocabulary with clustered vectors"""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{i}" for i in range(vocabulary)])
+    ranks = (rng.zipf(1.2, size=(n, words_per_chunk)) - 1) % vocabulary
+    texts = [" ".join(row) for row in words[ranks]]
+    centers = rng.normal(size=(n // 50 + 1, EMBEDDING_DIM))
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.6 * rng.normal(size=(n, EMBEDDING_DIM))
+    return texts, vectors.astype(np.float32)
+
+
+def run(label, search, queries, k):
+    hits, latencies = 0, []
+    for query, expected in queries:
+        start = time.perf_counter()
+        results = search(query)
+        latencies.append(time.perf_counter() - start)
+        hits += expected in results[:k]
+    latencies = 1000 * np.array(latencies)
+    print(f"{label:>8} {hits / len(queries):>10.3f} {np.median(latencies):>10.3f} "
+          f"{np.percentile(latencies, 95):>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", help="JSON file of labelled queries")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random chunks instead of MongoDB")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+    if not args.labels and not args.synthetic:
+        parser.error("either --labels or --synthetic is required")
+
+    print(f"{'mode':>8} {'hit@' + str(args.k):>10} {'p50 ms':>10} {'p95 ms':>10}")
+
+    if args.synthetic:
+        texts, vectors = synthetic_corpus(args.synthetic)
+        index = VectorIndex()
+        index.add(list(range(len(texts))), vectors)
+        bm25 = BM25Index()
+        bm25.add(list(range(len(texts))), texts)
+
+        # A noisy copy of a chunk's vector plus one rare and two common words of it stands in for a question
+        rng = np.random.default_rng(1)
+        targets = rng.choice(len(texts), min(args.queries, len(texts)), replace=False)
+        queries = []
+        for target in targets:
+            words = sorted(set(texts[target].split()), key=lambda w: int(w[1:]))
+            words = [words[-1], *rng.choice(words[:20], 2, replace=False)]
+            vector = vectors[target] + 4.0 * rng.normal(size=EMBEDDING_DIM)
+            queries.append(((" ".join(words), vector), target))
+
+        run("vector", lambda q: [i for i, _ in index.search(q[1], args.k)], queries, args.k)
+        run("bm25", lambda q: [i for i, _ in bm25.search(q[0], args.k)], queries, args.k)
+        run("hybrid", lambda q: [
+            i for i, _ in hybrid_search(q[0], q[1], index, bm25, args.k, args.candidates)
+        ], queries, args.k)
+        return
+
+    from modules.database import get_collection
+    from modules.embeddings import get_embeddings
+    from modules.load_vectorstore import similarity_search
+    with open(args.labels) as f:
+        labels = json.load(f)
+    queries = [(item["query"], item["source"]) for item in labels]
+    collection = get_collection()
+    embeddings = get_embeddings()
+    for mode, hybrid in (("vector", False), ("hybrid", True)):
+        # Warm up indexes and the query embedding cache so only retrieval is timed
+        for query, _ in queries:
+            similarity_search(query, collection, embeddings, args.k, hybrid=hybrid)
+        run(mode, lambda q: [
+            doc.get("source") for doc in similarity_search(
+                q, collection, embeddings, args.k, hybrid=hybrid, candidates=args.candidates
+            )
+        ], queries, args.k)
+
+
+if __name__ == "__main__":
+    main()
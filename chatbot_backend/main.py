@@ -1,20 +1,79 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
 import uuid
 from datetime import datetime
 import json
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 
-from modules.database import get_collection, create_indexes
-from modules.load_vectorstore import load_vectorstore, load_json_data
-from modules.llm import get_llm_chain
-from modules.query_handlers import query_chain
+from modules.database import (
+    get_collection, get_async_collection, create_indexes, close_connection, pool_stats,
+    CHAT_SESSIONS_COLLECTION, SOURCES_COLLECTION
+)
+from modules.chat_store import (
+    get_messages, delete_messages, migrate_embedded_messages, save_exchange, get_chat_write_behind,
+    list_sessions, owner_query, CHAT_WRITE_BEHIND, DEFAULT_PAGE_SIZE
+)
+from modules.load_vectorstore import save_uploaded_files, delete_documents_by_source, load_side_index
+from modules.ingest_jobs import get_ingest_manager
+from modules.pdf_parsing import shutdown_pdf_pool
+from modules.llm import get_llm_chain, RETRIEVAL_MODE
+from modules.vector_index import get_vector_index
+from modules.bm25_index import get_bm25_index
+from modules.metadata_index import get_metadata_index
+from modules.vector_snapshot import get_snapshot_store, load_vector_index
+from modules.embeddings import get_embeddings, embedding_stats
+from modules.embedding_cache import get_query_cache
+from modules.answer_cache import get_answer_cache
+from modules.reranker import get_reranker, RERANK_ENABLED
+from modules.auth import current_user_id
+from modules.query_handlers import coalesced_query_chain, stream_query_chain
+from modules.single_flight import get_single_flight
+from modules.llm_limiter import get_llm_limiter, LLMOverloaded
+from modules.conversation_state import get_conversation_state
 from modules.admin_handlers import AdminHandler
+from modules.executor import run_blocking, shutdown_executor
 from logger import logger
 
-app = FastAPI(title="Universal AI API")
+# Initialize LLM chain on startup
+llm_chain = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global llm_chain
+    try:
+        create_indexes()
+        collection = get_collection()
+        load_vector_index(get_vector_index(), collection)
+        # Full collection scans belong here, not in the first filtered or hybrid request
+        load_side_index(get_metadata_index(), get_vector_index(), collection)
+        if RETRIEVAL_MODE == "hybrid":
+            load_side_index(get_bm25_index(), get_vector_index(), collection)
+        get_embeddings().warmup()
+        if RERANK_ENABLED:
+            get_reranker().warmup()
+        llm_chain = get_llm_chain(collection)
+        get_ingest_manager().start()
+        if CHAT_WRITE_BEHIND:
+            get_chat_write_behind().start()
+        logger.info("Application startup completed successfully")
+    except Exception as e:
+        logger.error(f"Startup error: {e}")
+    
+    yield
+    
+    get_ingest_manager().shutdown()
+    shutdown_pdf_pool()
+    get_snapshot_store().flush()
+    # Buffered chat writes must reach MongoDB before the client closes
+    await get_chat_write_behind().stop()
+    shutdown_executor()
+    close_connection()
+    logger.info("Application shutdown completed")
+
+app = FastAPI(title="Universal AI API", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -29,25 +88,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Initialize admin handler
 admin_handler = AdminHandler()
 
-# Initialize LLM chain on startup
-llm_chain = None
-
-@app.on_event("startup")
-async def startup_event():
-    global llm_chain
-    try:
-        create_indexes()
-        collection = get_collection()
-        llm_chain = get_llm_chain(collection)
-        logger.info("Application startup completed successfully")
-    except Exception as e:
-        logger.error(f"Startup error: {e}")
-
 # Pydantic models for chat history
 class ChatMessage(BaseModel):
     role: str
@@ -74,12 +120,39 @@ async def root():
 async def test():
     return {"status": "API is working"}
 
+def parse_retrieval_filters(source: Optional[str], document_type: Optional[str], filters: Optional[str]):
+    """Combine the source/document_type form fields with the optional JSON `filters` field.
+
+    `filters` may hold any of source, document_type, page (value, list, or a
+    {"gte", "lte"} range) and a "metadata" object of custom fields.
+    """
+    combined = {}
+    if filters:
+        try:
+            combined = json.loads(filters)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="filters must be a JSON object")
+        if not isinstance(combined, dict):
+            raise HTTPException(status_code=400, detail="filters must be a JSON object")
+    if source:
+        combined["source"] = source
+    if document_type:
+        combined["document_type"] = document_type
+    return combined or None
+
 @app.post("/ask/")
-async def ask_question(question: str = Form(...), session_id: Optional[str] = Form(None)):
+async def ask_question(
+    question: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    source: Optional[str] = Form(None),
+    document_type: Optional[str] = Form(None),
+    filters: Optional[str] = Form(None)
+):
     try:
         # Add input validation
         if not question or question.strip() == "":
             raise HTTPException(status_code=400, detail="Question cannot be empty")
+        retrieval_filters = parse_retrieval_filters(source, document_type, filters)
         
         if not llm_chain:
             logger.error("LLM chain not initialized")
@@ -88,7 +161,8 @@ async def ask_question(question: str = Form(...), session_id: Optional[str] = Fo
         logger.info(f"Processing question: {question[:100]}...")
         
         # Call the query chain
-        response = query_chain(llm_chain, question)
+        # Concurrent identical questions await one shared retrieval + LLM call
+        response = await coalesced_query_chain(llm_chain, question, retrieval_filters, session_id)
         
         # Validate response structure
         if not isinstance(response, dict):
@@ -113,26 +187,88 @@ async def ask_question(question: str = Form(...), session_id: Optional[str] = Fo
         
     except HTTPException:
         raise
+    except LLMOverloaded as e:
+        logger.warning(f"Rejecting question, LLM overloaded: {e}")
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))}
+        )
     except Exception as e:
         logger.error(f"Error processing question: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/ask/stream")
+async def ask_question_stream(
+    request: Request,
+    question: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    source: Optional[str] = Form(None),
+    document_type: Optional[str] = Form(None),
+    filters: Optional[str] = Form(None)
+):
+    """Stream the answer as Server-Sent Events: sources, then tokens, then done"""
+    if not question or question.strip() == "":
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    retrieval_filters = parse_retrieval_filters(source, document_type, filters)
+    
+    if not llm_chain:
+        logger.error("LLM chain not initialized")
+        raise HTTPException(status_code=500, detail="LLM chain not initialized")
+    
+    # Shed load before the 200 and the event stream have started
+    if get_llm_limiter().saturated():
+        raise HTTPException(status_code=503, detail="LLM queue is full", headers={"Retry-After": "1"})
+    
+    logger.info(f"Streaming question: {question[:100]}...")
+    
+    async def event_stream():
+        events = stream_query_chain(llm_chain, question, retrieval_filters, session_id)
+        try:
+            async for event in events:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, cancelling generation")
+                    return
+                
+                # Persist the finished exchange before the final event goes out
+                if event["type"] == "done" and session_id:
+                    try:
+                        await save_message_to_session(session_id, question, event["response"])
+                        logger.info(f"Saved conversation to session: {session_id}")
+                    except Exception as session_error:
+                        logger.warning(f"Failed to save to session {session_id}: {session_error}")
+                
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming question: {str(e)}", exc_info=True)
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+        finally:
+            # Closes the upstream astream, cancelling the Groq request
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Chat History Endpoints
+# Sessions belong to the userId of the caller's verified bearer token; anonymous callers share the null owner,
+# as do sessions from before owners existed (see scripts/assign_session_owners.py)
 @app.post("/chat/new")
-async def create_new_chat(request: NewChatRequest):
+async def create_new_chat(request: NewChatRequest, owner: Optional[str] = Depends(current_user_id)):
     try:
         session_id = str(uuid.uuid4())
         chat_session = {
             "session_id": session_id,
+            "owner": owner,
             "title": request.title,
-            "messages": [],
+            "message_count": 0,
             "created_at": datetime.now(),
             "updated_at": datetime.now()
         }
         
-        # Store in MongoDB
-        collection = get_collection("chat_sessions")
-        collection.insert_one(chat_session)
+        # Store in MongoDB; messages live in their own collection
+        collection = get_async_collection(CHAT_SESSIONS_COLLECTION)
+        await collection.insert_one(chat_session)
         
         logger.info(f"Created new chat session: {session_id}")
         return {"session_id": session_id, "title": request.title}
@@ -141,41 +277,82 @@ async def create_new_chat(request: NewChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/chat/sessions")
-async def get_chat_sessions():
+async def get_chat_sessions(
+    response: Response,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    owner: Optional[str] = Depends(current_user_id)
+):
+    """One page of the caller's sessions, most recent first.
+
+    The body stays a plain list; the cursor for the next page is returned
+    in the X-Next-Cursor header (absent on the last page).
+    """
     try:
-        collection = get_collection("chat_sessions")
-        sessions = list(collection.find(
-            {},
-            {"session_id": 1, "title": 1, "created_at": 1, "updated_at": 1, "_id": 0}
-        ).sort("updated_at", -1))
+        try:
+            sessions, next_cursor = await list_sessions(owner, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         # Convert datetime to string for JSON serialization
         for session in sessions:
             session["created_at"] = session["created_at"].isoformat()
             session["updated_at"] = session["updated_at"].isoformat()
         
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return sessions
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting chat sessions: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/chat/{session_id}")
-async def get_chat_session(session_id: str):
+async def get_chat_session(
+    session_id: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    before: Optional[int] = None,
+    owner: Optional[str] = Depends(current_user_id)
+):
+    """Session metadata plus one page of messages: the latest `limit`, or those before the `before` cursor.
+
+    `next_cursor` is passed back as `before` to load older messages; it is
+    null once the start of the conversation is reached.
+    """
     try:
-        collection = get_collection("chat_sessions")
-        session = collection.find_one({"session_id": session_id}, {"_id": 0})
+        # Read-your-writes when exchanges of this session are still buffered
+        write_behind = get_chat_write_behind()
+        if write_behind.pending(session_id):
+            await write_behind.flush()
+        
+        collection = get_async_collection(CHAT_SESSIONS_COLLECTION)
+        session = await collection.find_one(
+            {"session_id": session_id, **owner_query(owner)}, {"_id": 0, "recent_exchanges": 0}
+        )
         
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
+        session.pop("owner", None)
+        
+        # Sessions written before messages moved out of the session document
+        if await migrate_embedded_messages(session):
+            session["message_count"] = session.get("message_count", 0) + len(session.pop("messages"))
+        session.pop("messages", None)
+        
+        messages, next_cursor = await get_messages(session_id, limit, before)
         
         # Convert datetime to string for JSON serialization
         session["created_at"] = session["created_at"].isoformat()
         session["updated_at"] = session["updated_at"].isoformat()
         
-        for message in session["messages"]:
+        for message in messages:
             if "timestamp" in message:
                 message["timestamp"] = message["timestamp"].isoformat()
         
+        session["messages"] = messages
+        session["next_cursor"] = next_cursor
+        session["has_more"] = next_cursor is not None
         return session
     except HTTPException:
         raise
@@ -184,14 +361,17 @@ async def get_chat_session(session_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/chat/{session_id}")
-async def delete_chat_session(session_id: str):
+async def delete_chat_session(session_id: str, owner: Optional[str] = Depends(current_user_id)):
     try:
-        collection = get_collection("chat_sessions")
-        result = collection.delete_one({"session_id": session_id})
+        collection = get_async_collection(CHAT_SESSIONS_COLLECTION)
+        result = await collection.delete_one({"session_id": session_id, **owner_query(owner)})
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Chat session not found")
         
+        await delete_messages(session_id)
+        get_conversation_state().forget(session_id)
+        
         logger.info(f"Deleted chat session: {session_id}")
         return {"message": "Chat session deleted successfully"}
     except HTTPException:
@@ -203,63 +383,15 @@ async def delete_chat_session(session_id: str):
 async def save_message_to_session(session_id: str, question: str, response: dict):
     """Save a conversation to a chat session"""
     try:
-        collection = get_collection("chat_sessions")
-        
-        user_message = {
-            "role": "user",
-            "content": question,
-            "timestamp": datetime.now()
-        }
-        
-        assistant_message = {
-            "role": "assistant",
-            "content": response["response"],
-            "sources": response.get("sources", []),
-            "response_type": response.get("response_type", "general"),
-            "timestamp": datetime.now()
-        }
-        
-        # Check if this is the first message in the session
-        session = collection.find_one({"session_id": session_id})
-        is_first_message = not session or len(session.get("messages", [])) == 0
-        
-        collection.update_one(
-            {"session_id": session_id},
-            {
-                "$push": {
-                    "messages": {
-                        "$each": [user_message, assistant_message]
-                    }
-                },
-                "$set": {"updated_at": datetime.now()}
-            }
-        )
-        
-        # Only update title if it's still "New Chat"
-        if is_first_message and session and session.get("title") == "New Chat":
-            title = question.strip()
-            
-            if title and not title[0].isupper():
-                title = title[0].upper() + title[1:]
-            
-            if len(title) > 50:
-                title = title[:50]
-                last_space = title.rfind(' ')
-                if last_space > 30:
-                    title = title[:last_space] + "..."
-                else:
-                    title = title + "..."
-            
-            collection.update_one(
-                {"session_id": session_id},
-                {"$set": {"title": title}}
-            )
-        
+        if CHAT_WRITE_BEHIND:
+            get_chat_write_behind().submit(session_id, question, response)
+        else:
+            await save_exchange(session_id, question, response)
     except Exception as e:
         logger.error(f"Error saving message to session {session_id}: {e}")
 
 # Admin endpoints
-@app.post("/admin/upload_pdfs/")
+@app.post("/admin/upload_pdfs/", status_code=202)
 async def admin_upload_pdfs(
     admin_key: str = Form(...),
     files: List[UploadFile] = File(...)
@@ -271,78 +403,116 @@ async def admin_upload_pdfs(
         if not files or len(files) == 0:
             raise HTTPException(status_code=400, detail="No files uploaded")
 
-        total_docs = load_vectorstore(files)
-        logger.info(f"Admin uploaded {len(files)} PDF files, created {total_docs} documents")
+        # Only save the files here; parsing, embedding and inserting run as a background job
+        file_paths = await run_blocking(save_uploaded_files, files)
+        job_id = await run_blocking(get_ingest_manager().submit, file_paths)
+        logger.info(f"Admin uploaded {len(files)} PDF files, queued ingest job {job_id}")
         
         return {
-            "message": f"Successfully uploaded {len(files)} PDF files",
+            "message": f"Uploaded {len(files)} PDF files, processing in background",
             "files_count": len(files),
-            "documents_created": total_docs
+            "job_id": job_id,
+            "status": "queued"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in admin PDF upload: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/admin/jobs/{job_id}")
+async def get_ingest_job(job_id: str, admin_key: str):
+    if not admin_handler.verify_admin_key(admin_key):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+    
+    job = await run_blocking(get_ingest_manager().get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    
+    job["created_at"] = job["created_at"].isoformat()
+    job["updated_at"] = job["updated_at"].isoformat()
+    return job
+
 @app.get("/admin/stats/")
 async def get_admin_stats(admin_key: str):
     if not admin_handler.verify_admin_key(admin_key):
         raise HTTPException(status_code=403, detail="Invalid admin key")
     
     try:
-        collection = get_collection()
-        
-        total_docs = collection.count_documents({})
-        pdf_docs = collection.count_documents({"document_type": "pdf"})
+        # Collection metadata and the per-file catalog instead of scanning every chunk
+        total_docs = await get_async_collection().estimated_document_count()
+        totals = await get_async_collection(SOURCES_COLLECTION).aggregate([
+            {"$match": {"document_type": "pdf"}},
+            {"$group": {
+                "_id": None,
+                "files": {"$sum": 1},
+                "chunks": {"$sum": "$chunk_count"},
+                "bytes": {"$sum": "$byte_size"},
+                "pages": {"$sum": "$page_count"}
+            }}
+        ]).to_list(length=1)
+        pdf_totals = totals[0] if totals else {}
         
         return {
             "total_documents": total_docs,
-            "pdf_documents": pdf_docs,           
+            "pdf_documents": pdf_totals.get("chunks", 0),
+            "pdf_files": pdf_totals.get("files", 0),
+            "pdf_bytes": pdf_totals.get("bytes", 0),
+            "pdf_pages": pdf_totals.get("pages", 0),
         }
     except Exception as e:
         logger.error(f"Error getting admin stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/admin/metrics/")
+async def get_admin_metrics(admin_key: str):
+    if not admin_handler.verify_admin_key(admin_key):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+    
+    return {
+        "embeddings": embedding_stats(),
+        "query_embedding_cache": get_query_cache().stats(),
+        "answer_cache": get_answer_cache().stats(),
+        "reranker": get_reranker().stats(),
+        "single_flight": get_single_flight().stats(),
+        "llm_admission": get_llm_limiter().stats(),
+        "chat_write_behind": get_chat_write_behind().stats(),
+        "conversation_state": get_conversation_state().stats(),
+        "mongodb": pool_stats(),
+    }
+
 @app.get("/admin/pdfs/")
 async def get_admin_pdfs(admin_key: str):
     if not admin_handler.verify_admin_key(admin_key):
         raise HTTPException(status_code=403, detail="Invalid admin key")
     
     try:
-        collection = get_collection()
+        collection = get_async_collection(SOURCES_COLLECTION)
         
-        # Get unique PDF files from the collection
-        pipeline = [
-            {"$match": {"document_type": "pdf"}},
-            {"$group": {
-                "_id": "$source",
-                "filename": {"$first": "$source"},
-                "document_count": {"$sum": 1},
-                "first_seen": {"$min": "$_id"}
-            }},
-            {"$project": {
-                "_id": 0,
-                "filename": {"$arrayElemAt": [{"$split": ["$filename", "/"]}, -1]},
-                "full_path": "$filename",
-                "document_count": 1,
-                "upload_date": {"$toDate": "$first_seen"}
-            }},
-            {"$sort": {"upload_date": -1}}
-        ]
-        
-        pdfs = list(collection.aggregate(pipeline))
+        # One catalog record per file, kept current by ingest and delete
+        pdfs = await collection.find(
+            {"document_type": "pdf"},
+            {
+                "_id": 0, "source": 1, "byte_size": 1, "page_count": 1, "chunk_count": 1,
+                "ingest_seconds": 1, "created_at": 1, "updated_at": 1
+            }
+        ).sort("created_at", -1).to_list(length=None)
         
         # Process the results
         processed_pdfs = []
         for pdf in pdfs:
-            filename_parts = pdf["filename"].replace('\\', '/').split('/')
+            filename_parts = pdf["source"].replace('\\', '/').split('/')
             clean_filename = filename_parts[-1]
             
             processed_pdfs.append({
                 "filename": clean_filename,
-                "full_path": pdf["full_path"],
-                "document_count": pdf["document_count"],
-                "upload_date": pdf["upload_date"].isoformat(),
-                "size": pdf["document_count"] * 1024
+                "full_path": pdf["source"],
+                "document_count": pdf.get("chunk_count", 0),
+                "upload_date": pdf["created_at"].isoformat(),
+                "size": pdf.get("byte_size", 0),
+                "page_count": pdf.get("page_count", 0),
+                "ingest_seconds": pdf.get("ingest_seconds"),
+                "updated_at": pdf["updated_at"].isoformat()
             })
         
         logger.info(f"Admin fetched {len(processed_pdfs)} PDF files")
@@ -358,27 +528,16 @@ async def admin_delete_file(filename: str, admin_key: str):
         raise HTTPException(status_code=403, detail="Invalid admin key")
     
     try:
-        collection = get_collection()
+        deleted_count = await run_blocking(delete_documents_by_source, filename)
         
-        # Try exact match first
-        result = collection.delete_many({"source": filename})
-        
-        # If no exact match, try matching documents that end with the filename
-        if result.deleted_count == 0:
-            import re
-            escaped_filename = re.escape(filename)
-            result = collection.delete_many({
-                "source": {"$regex": f".*{escaped_filename}$", "$options": "i"}
-            })
-        
-        if result.deleted_count == 0:
+        if deleted_count == 0:
             raise HTTPException(status_code=404, detail=f"No documents found for '{filename}'")
         
-        logger.info(f"Admin deleted {result.deleted_count} documents for '{filename}'")
+        logger.info(f"Admin deleted {deleted_count} documents for '{filename}'")
         
         return {
             "message": f"Successfully deleted '{filename}'",
-            "deleted_count": result.deleted_count
+            "deleted_count": deleted_count
         }
         
     except HTTPException:
@@ -0,0 +1,327 @@
+import threading
+import time
+import numpy as np
+from modules.vector_index import VectorIndex, EMBEDDING_DIM, normalize_vectors
+from logger import logger
+
+# Minimum training points per list before the coarse quantizer is trained
+MIN_POINTS_PER_LIST = 39
+# Rows scored against the centroids at a time when assigning vectors to lists
+ASSIGN_BATCH_SIZE = 16384
+
+
+def nearest_centroids(rows, centroids):
+    """Index of the most similar centroid for each row, in bounded-memory batches"""
+    return np.concatenate([
+        np.argmax(rows[start:start + ASSIGN_BATCH_SIZE] @ centroids.T, axis=1)
+        for start in range(0, len(rows), ASSIGN_BATCH_SIZE)
+    ]) if len(rows) else np.empty(0, dtype=np.int64)
+
+
+def build_lists(assignment, nlist, offset=0):
+    """Group row numbers (offset + position) by their assigned list"""
+    order = np.argsort(assignment, kind="stable").astype(np.int64) + offset
+    counts = np.bincount(assignment, minlength=nlist)
+    return np.split(order, np.cumsum(counts)[:-1])
+
+
+class IVFIndex(VectorIndex):
+    """Approximate cosine index using an inverted file over k-means centroids.
+
+    Each vector is assigned to its nearest centroid; a query only scores the
+    vectors in its `nprobe` closest lists. Raising `nprobe` trades latency for
+    recall, `nlist` controls list granularity (defaults to 4 * sqrt(N)).
+    Until there is enough data to train, searches fall back to an exact scan.
+
+    Training runs k-means without holding the index lock (in a background
+    thread when triggered by growth), so searches and inserts are not blocked
+    by it; the new centroids and lists are swapped in when it finishes.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, nlist=None, nprobe=8, kmeans_iterations=10,
+                 retrain_growth=4.0, compact_ratio=0.25):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iterations = kmeans_iterations
+        self.retrain_growth = retrain_growth
+        self.compact_ratio = compact_ratio
+        self._train_lock = threading.Lock()
+        self._train_thread = None
+        self._generation = 0
+        super().__init__(dim)
+
+    @property
+    def trained(self):
+        return self._centroids is not None
+
+    def remove(self, ids):
+        """Tombstone chunks; rows are reclaimed when enough of them are dead"""
+        removed = 0
+        with self._lock:
+            for doc_id in ids:
+                pos = self._positions.pop(doc_id, None)
+                if pos is None:
+                    continue
+                self._alive[pos] = False
+                self._dead += 1
+                removed += 1
+            self.dirty = self.dirty or removed > 0
+            if self._dead and self._dead > self.compact_ratio * self._size:
+                self._compact()
+        return removed
+
+    def __len__(self):
+        return self._size - self._dead
+
+    def search(self, query_vector, k=3, nprobe=None, ids=None):
+        """Return the approximate top-k (id, similarity) pairs for a query embedding.
+
+        With `ids`, those chunks are scored exactly instead of probing lists.
+        """
+        query = normalize_vectors(query_vector).reshape(-1)
+        with self._lock:
+            if ids is not None:
+                return self._search_subset(query, ids, k)
+            if not self.trained:
+                return self._exact(query, k)
+
+            nprobe = min(nprobe or self.nprobe, len(self._centroids))
+            centroid_scores = self._centroids @ query
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            candidates = np.concatenate([self._lists[p] for p in probes])
+            candidates = candidates[self._alive[candidates]]
+            return self._top_k(candidates, self._buffer[candidates] @ query, k)
+
+    def exact_search(self, query_vector, k=3):
+        """Return the exact top-k over the live vectors (ground truth for recall)"""
+        query = normalize_vectors(query_vector).reshape(-1)
+        with self._lock:
+            return self._exact(query, k)
+
+    def train(self):
+        """(Re)train the coarse quantizer on the live vectors and rebuild the lists"""
+        with self._train_lock:
+            return self._train()
+
+    def wait_for_training(self, timeout=None):
+        """Block until a background training run (if any) has finished"""
+        thread = self._train_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _train(self):
+        with self._lock:
+            self._compact()
+            n = self._size
+            nlist = self.nlist or int(4 * np.sqrt(n))
+            nlist = max(1, min(nlist, n // MIN_POINTS_PER_LIST))
+            if nlist < 2:
+                return False
+            # Rows [0, n) are only rewritten by _compact, which copies the buffer while this is set
+            data = self._buffer[:n]
+            generation, layout_version = self._generation, self._layout_version
+            self._reading_buffer = True
+
+        try:
+            start = time.perf_counter()
+            centroids = self._kmeans(data, nlist)
+            assignment = nearest_centroids(data, centroids)
+        finally:
+            with self._lock:
+                self._reading_buffer = False
+
+        with self._lock:
+            if self._generation != generation:
+                # The index was reloaded meanwhile; its own training supersedes this one
+                return False
+            self._centroids = centroids
+            self._trained_size = n
+            if self._layout_version == layout_version:
+                self._lists = build_lists(assignment, nlist)
+                self._assign(n, self._size)
+            else:
+                self._lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+                self._assign(0, self._size)
+        logger.info(f"Trained IVF index with {nlist} lists over {n} vectors "
+                    f"in {time.perf_counter() - start:.2f}s")
+        return True
+
+    def _kmeans(self, data, nlist):
+        # Spherical k-means: assign by max cosine, re-normalize the means
+        n = len(data)
+        rng = np.random.default_rng(0)
+        sample_size = min(n, nlist * 256)
+        sample = data[np.sort(rng.choice(n, sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            assignment = nearest_centroids(sample, centroids)
+            counts = np.bincount(assignment, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.empty_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(sample[np.argsort(assignment, kind="stable")],
+                                           starts[filled], axis=0)
+            sums[~filled] = sample[rng.integers(sample_size, size=int((~filled).sum()))]
+            centroids = normalize_vectors(sums)
+        return np.ascontiguousarray(centroids)
+
+    def _train_in_background(self):
+        # Called with self._lock held; at most one background run at a time
+        if self._train_thread is not None and self._train_thread.is_alive():
+            return
+        self._train_thread = threading.Thread(target=self._background_train, name="ivf-train", daemon=True)
+        self._train_thread.start()
+
+    def _background_train(self):
+        try:
+            self.train()
+        except Exception as e:
+            logger.error(f"Error training IVF index: {e}")
+
+    def load_arrays(self, vectors, ids, snapshot_version=None, quantizer=None):
+        """Adopt a snapshot matrix with its persisted centroids and list assignment.
+
+        Without a usable `quantizer` (e.g. a snapshot written by a flat index)
+        the coarse quantizer is retrained over it in the background.
+        """
+        with self._lock:
+            super().load_arrays(vectors, ids, snapshot_version)
+            self._alive = np.ones(self._size, dtype=bool)
+            if quantizer is not None and len(quantizer["assignment"]) == self._size \
+                    and quantizer["centroids"].shape[1:] == (self.dim,):
+                self._centroids = np.ascontiguousarray(quantizer["centroids"], dtype=np.float32)
+                self._lists = build_lists(np.asarray(quantizer["assignment"], dtype=np.int64),
+                                          len(self._centroids))
+                self._trained_size = quantizer.get("trained_size") or self._size
+            elif self._size >= 2 * MIN_POINTS_PER_LIST:
+                self._train_in_background()
+
+    def export_arrays(self):
+        with self._lock:
+            self._compact()
+            vectors, ids, _ = super().export_arrays()
+            if not self.trained:
+                return vectors, ids, None
+            assignment = np.empty(self._size, dtype=np.int32)
+            for c, rows in enumerate(self._lists):
+                assignment[rows] = c
+            quantizer = {
+                "centroids": np.array(self._centroids),
+                "assignment": assignment,
+                "trained_size": self._trained_size,
+            }
+            return vectors, ids, quantizer
+
+    def list_sizes(self):
+        """Return the number of vectors in each inverted list"""
+        with self._lock:
+            return [len(lst) for lst in self._lists] if self.trained else []
+
+    def _reset(self):
+        super()._reset()
+        self._alive = np.empty(0, dtype=bool)
+        self._dead = 0
+        self._centroids = None
+        self._lists = []
+        self._trained_size = 0
+        self._generation += 1
+        self._layout_version = 0
+        self._reading_buffer = False
+
+    def _append(self, ids, vectors):
+        if not ids:
+            return
+        start = self._size
+        super()._append(ids, vectors)
+        if len(self._alive) < len(self._buffer):
+            alive = np.zeros(len(self._buffer), dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._alive = alive
+        self._alive[start:self._size] = True
+
+        if self.trained:
+            self._assign(start, self._size)
+        if not self.trained or self._size > self.retrain_growth * self._trained_size:
+            if self._size >= 2 * MIN_POINTS_PER_LIST:
+                self._train_in_background()
+
+    def _assign(self, start, end):
+        if start == end:
+            return
+        assignment = nearest_centroids(self._buffer[start:end], self._centroids)
+        for c, rows in enumerate(build_lists(assignment, len(self._centroids), offset=start)):
+            if len(rows):
+                self._lists[c] = np.concatenate([self._lists[c], rows])
+
+    def _compact(self):
+        """Drop tombstoned rows and rebuild the inverted lists without retraining"""
+        if not self._dead:
+            return
+        if self._reading_buffer:
+            # A training run reads the current rows outside the lock: rewrite a copy
+            self._buffer = np.array(self._buffer)
+        self._ensure_writable()
+        keep = np.flatnonzero(self._alive[:self._size])
+        ids = [self._ids[i] for i in keep]
+        rows = self._buffer[keep]
+        n = len(keep)
+
+        self._buffer[:n] = rows
+        self._alive[:] = False
+        self._alive[:n] = True
+        self._ids = ids
+        self._positions = {doc_id: pos for pos, doc_id in enumerate(ids)}
+        self._size = n
+        self._dead = 0
+        self._layout_version += 1
+        if self.trained:
+            self._lists = [np.empty(0, dtype=np.int64) for _ in range(len(self._centroids))]
+            self._assign(0, n)
+
+    def _exact(self, query, k):
+        scores = self._buffer[:self._size] @ query
+        scores[~self._alive[:self._size]] = -np.inf
+        k = min(k, self._size - self._dead)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._ids[i], float(scores[i])) for i in top]
+
+    def _top_k(self, candidates, scores, k):
+        if len(candidates) == 0:
+            return []
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._ids[candidates[i]], float(scores[i])) for i in top]
+
+
+def recall_report(index, queries, k=10, nprobe_values=(1, 2, 4, 8, 16, 32)):
+    """Measure recall@k and latency of an IVF index against exact search.
+
+    Returns one row per `nprobe` setting so a deployment can pick the
+    cheapest setting that meets its recall target.
+    """
+    queries = normalize_vectors(queries).reshape(-1, index.dim)
+
+    start = time.perf_counter()
+    truth = [{doc_id for doc_id, _ in index.exact_search(q, k)} for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+    report = []
+    for nprobe in nprobe_values:
+        start = time.perf_counter()
+        results = [index.search(q, k, nprobe=nprobe) for q in queries]
+        elapsed_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+        hits = sum(len(expected & {doc_id for doc_id, _ in found})
+                   for expected, found in zip(truth, results))
+        total = sum(len(expected) for expected in truth)
+        report.append({
+            "nprobe": nprobe,
+            "recall_at_k": hits / total if total else 1.0,
+            "latency_ms": elapsed_ms,
+            "exact_latency_ms": exact_ms,
+        })
+    return report
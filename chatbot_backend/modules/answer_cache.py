@@ -0,0 +1,121 @@
+import copy
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from modules.vector_index import normalize_vectors
+from logger import logger
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+
+
+class SemanticAnswerCache:
+    """Cache of LLM answers keyed by question embedding and retrieved source set.
+
+    A lookup hits when an earlier question retrieved exactly the same chunks and
+    its embedding is within `threshold` cosine similarity of the new one.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl_seconds=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_sources = {}
+        self._next_id = itertools.count()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, query_vector, source_key):
+        """Return a cached response for a near-identical question, or None"""
+        query = normalize_vectors(query_vector).reshape(-1)
+        now = time.time()
+        with self._lock:
+            entry_ids = [
+                entry_id for entry_id in self._by_sources.get(source_key, ())
+                if not self._expire(entry_id, now)
+            ]
+            if entry_ids:
+                vectors = np.stack([self._entries[entry_id][0] for entry_id in entry_ids])
+                scores = vectors @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry_id = entry_ids[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return copy.deepcopy(self._entries[entry_id][2])
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, source_key, response, generation):
+        """Cache a response unless the corpus changed since `generation` was read"""
+        vector = normalize_vectors(query_vector).reshape(-1)
+        with self._lock:
+            if generation != self.generation:
+                return
+            entry_id = next(self._next_id)
+            self._entries[entry_id] = (vector, source_key, copy.deepcopy(response), time.time())
+            self._by_sources.setdefault(source_key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self):
+        """Drop every cached answer, e.g. after the document corpus changed"""
+        with self._lock:
+            self._entries.clear()
+            self._by_sources.clear()
+            self.generation += 1
+            self.invalidations += 1
+        logger.info("Answer cache invalidated")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+    def _expire(self, entry_id, now):
+        if now - self._entries[entry_id][3] > self.ttl_seconds:
+            self._drop(entry_id)
+            return True
+        return False
+
+    def _drop(self, entry_id):
+        _, source_key, _, _ = self._entries.pop(entry_id)
+        ids = self._by_sources.get(source_key)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_sources[source_key]
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Get the process-wide answer cache"""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache()
+    return _answer_cache
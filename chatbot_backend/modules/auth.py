@@ -0,0 +1,70 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi import Header, HTTPException
+from logger import logger
+
+load_dotenv()
+
+# Secret the Node backend signs its HS256 login tokens with; without it every caller is anonymous
+JWT_SECRET = os.environ.get("JWT_SECRET")
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def verify_token(token, secret=JWT_SECRET):
+    """Return the claims of an HS256 JWT signed with `secret`; raises InvalidToken otherwise"""
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        payload = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except ValueError as e:
+        raise InvalidToken("Malformed token") from e
+
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise InvalidToken("Unsupported token algorithm")
+    expected = hmac.new(secret.encode(), f"{header_b64}.{payload_b64}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidToken("Invalid token signature")
+    if not isinstance(payload, dict):
+        raise InvalidToken("Malformed token")
+    exp = payload.get("exp")
+    if exp is not None and time.time() >= exp:
+        raise InvalidToken("Token expired")
+    return payload
+
+
+async def current_user_id(authorization: Optional[str] = Header(None)):
+    """FastAPI dependency: the userId of the caller's bearer token, or None for anonymous callers.
+
+    A token that is present but does not verify is rejected with 401 rather
+    than treated as anonymous.
+    """
+    if not authorization or not JWT_SECRET:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Invalid authorization header")
+    try:
+        user_id = verify_token(token.strip()).get("userId")
+    except InvalidToken as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Token has no user")
+    return str(user_id)
+
+
+if not JWT_SECRET:
+    logger.warning("JWT_SECRET is not set: chat sessions are not scoped to users")
@@ -0,0 +1,258 @@
+import re
+import threading
+import time
+from collections import Counter
+import numpy as np
+from logger import logger
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its my of on or
+should so than that the their them then there these they this to was what when where which who
+why will with would you your
+""".split())
+
+
+def tokenize(text):
+    """Lower-case alphanumeric tokens without stopwords"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over chunk `content`, updated incrementally.
+
+    Postings are kept as Python lists for cheap appends and converted to
+    numpy arrays on first use after a change, so scoring a query is a few
+    vectorized passes over the postings of its terms.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.loaded = False
+        # Vector snapshot version this index was last brought in line with
+        self.synced_version = None
+        self._lock = threading.RLock()
+        self._reset()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def load(self, collection):
+        """Index the content of every chunk in MongoDB"""
+        start = time.perf_counter()
+        ids, texts = [], []
+        for doc in collection.find({}, {"content": 1}):
+            ids.append(doc["_id"])
+            texts.append(doc.get("content", ""))
+        with self._lock:
+            self._reset()
+            self._add(ids, texts)
+            self.loaded = True
+        logger.info(f"BM25 index built over {len(ids)} chunks in {time.perf_counter() - start:.2f}s")
+
+    def add(self, ids, texts):
+        with self._lock:
+            # A chunk may already have been picked up by sync
+            pairs = [(doc_id, text) for doc_id, text in zip(ids, texts) if doc_id not in self._positions]
+            self._add([doc_id for doc_id, _ in pairs], [text for _, text in pairs])
+
+    def sync(self, ids, collection):
+        """Bring the index in line with a set of live chunk ids, e.g. after another worker's ingest"""
+        with self._lock:
+            stale = set(self._positions) - ids
+            missing = ids.difference(self._positions)
+        docs = list(collection.find({"_id": {"$in": list(missing)}}, {"content": 1})) if missing else []
+        with self._lock:
+            self.remove(stale)
+            self.add([doc["_id"] for doc in docs], [doc.get("content", "") for doc in docs])
+        if stale or docs:
+            logger.info(f"BM25 index synced: {len(docs)} chunks added, {len(stale)} removed")
+
+    def remove(self, ids):
+        """Tombstone chunks; their postings are dropped on the next compaction"""
+        with self._lock:
+            for doc_id in ids:
+                pos = self._positions.pop(doc_id, None)
+                if pos is None:
+                    continue
+                self._alive[pos] = False
+                self._total_length -= self._lengths[pos]
+                self._df.clear()
+            if len(self._ids) > 2 * len(self._positions) + 1024:
+                self._compact()
+
+    def search(self, query, k=10, ids=None):
+        """Return the top-k (id, bm25 score) pairs for a query string.
+
+        With `ids`, only those chunks are scored: each term's postings are
+        probed for the allowed positions only, so the cost follows the size of
+        the filter rather than of the corpus. Corpus statistics (idf, average
+        length) still come from the whole index.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            live = len(self._positions)
+            if not terms or not live:
+                return []
+            candidates = None
+            if ids is not None:
+                candidates = np.unique(np.fromiter(
+                    (pos for pos in map(self._positions.get, ids) if pos is not None), dtype=np.int64
+                ))
+                if not len(candidates):
+                    return []
+
+            lengths = self._length_array()
+            avg_length = self._total_length / live
+            size = len(self._ids) if candidates is None else len(candidates)
+            scores = np.zeros(size, dtype=np.float32)
+            for term in terms:
+                postings = self._postings_array(term)
+                if postings is None:
+                    continue
+                docs, tfs = postings
+                df = self._document_frequency(term, docs)
+                if not df:
+                    continue
+                if candidates is None:
+                    slots = docs
+                else:
+                    # Postings are sorted by position: look up just the allowed chunks
+                    found = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                    hit = docs[found] == candidates
+                    slots = np.flatnonzero(hit)
+                    docs, tfs = candidates[hit], tfs[found[hit]]
+                alive = self._alive[docs]
+                idf = np.log(1 + (live - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avg_length)
+                scores += np.bincount(
+                    slots, weights=idf * tfs * (self.k1 + 1) / (tfs + norm) * alive,
+                    minlength=size
+                ).astype(np.float32)
+
+            matched = np.flatnonzero(scores)
+            if not len(matched):
+                return []
+            k = min(k, len(matched))
+            top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+            positions = top if candidates is None else candidates[top]
+            return [(self._ids[pos], float(scores[i])) for i, pos in zip(top, positions)]
+
+    def _reset(self):
+        self._ids = []
+        self._positions = {}
+        self._lengths = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._total_length = 0
+        self._postings = {}
+        self._arrays = {}
+        self._df = {}
+        self._lengths_cache = None
+
+    def _add(self, ids, texts):
+        if not ids:
+            return
+        start = len(self._ids)
+        for offset, (doc_id, text) in enumerate(zip(ids, texts)):
+            pos = start + offset
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                docs, tfs = self._postings.setdefault(term, ([], []))
+                docs.append(pos)
+                tfs.append(tf)
+                self._arrays.pop(term, None)
+                self._df.pop(term, None)
+            length = sum(counts.values())
+            self._ids.append(doc_id)
+            self._positions[doc_id] = pos
+            self._lengths.append(length)
+            self._total_length += length
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._lengths_cache = None
+
+    def _postings_array(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self._postings.get(term)
+            if postings is None:
+                return None
+            arrays = (np.asarray(postings[0], dtype=np.int64), np.asarray(postings[1], dtype=np.float32))
+            self._arrays[term] = arrays
+        return arrays
+
+    def _document_frequency(self, term, docs):
+        # Live chunks containing the term, cached until the next add/remove
+        df = self._df.get(term)
+        if df is None:
+            df = self._df[term] = int(self._alive[docs].sum())
+        return df
+
+    def _length_array(self):
+        if self._lengths_cache is None:
+            self._lengths_cache = np.asarray(self._lengths, dtype=np.float32)
+        return self._lengths_cache
+
+    def _compact(self):
+        """Renumber live chunks and rebuild postings without the tombstoned ones"""
+        keep = np.flatnonzero(self._alive)
+        remap = np.full(len(self._ids), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+
+        postings = {}
+        for term, (docs, tfs) in self._postings.items():
+            kept = [(int(remap[d]), tf) for d, tf in zip(docs, tfs) if remap[d] >= 0]
+            if kept:
+                postings[term] = ([d for d, _ in kept], [tf for _, tf in kept])
+
+        self._ids = [self._ids[i] for i in keep]
+        self._positions = {doc_id: pos for pos, doc_id in enumerate(self._ids)}
+        self._lengths = [self._lengths[i] for i in keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._postings = postings
+        self._arrays = {}
+        self._df = {}
+        self._lengths_cache = None
+
+
+def reciprocal_rank_fusion(rankings, k=3, rrf_k=60):
+    """Fuse ranked (id, score) lists: each id scores sum(1 / (rrf_k + rank))"""
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def hybrid_search(query, query_vector, vector_index, bm25_index, k=3, candidates=20, ids=None):
+    """Fuse the top `candidates` of the vector and BM25 rankings with RRF.
+
+    Hits carry the cosine similarity of each chunk rather than its RRF
+    score, so thresholds downstream keep their meaning.
+    """
+    fused = reciprocal_rank_fusion([
+        vector_index.search(query_vector, candidates, ids=ids),
+        bm25_index.search(query, candidates, ids=ids),
+    ], k)
+    ids = [doc_id for doc_id, _ in fused]
+    similarities = vector_index.similarities(ids, query_vector)
+    return [
+        (doc_id, similarity)
+        for doc_id, similarity in zip(ids, similarities)
+        if similarity is not None
+    ]
+
+
+_bm25_index = None
+_bm25_index_lock = threading.Lock()
+
+
+def get_bm25_index():
+    """Get the process-wide BM25 index"""
+    global _bm25_index
+    if _bm25_index is None:
+        with _bm25_index_lock:
+            if _bm25_index is None:
+                _bm25_index = BM25Index()
+    return _bm25_index
@@ -0,0 +1,436 @@
+import asyncio
+import base64
+import os
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from modules.database import get_async_collection, CHAT_SESSIONS_COLLECTION, CHAT_MESSAGES_COLLECTION
+from logger import logger
+
+load_dotenv()
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+SESSION_LIST_PROJECTION = {"session_id": 1, "title": 1, "created_at": 1, "updated_at": 1, "_id": 0}
+SESSION_LIST_SORT = [("updated_at", -1), ("session_id", -1)]
+DEFAULT_TITLE = "New Chat"
+
+# Buffer exchanges and write them in batches off the response path
+CHAT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND", "false").lower() == "true"
+CHAT_FLUSH_INTERVAL_MS = int(os.environ.get("CHAT_FLUSH_INTERVAL_MS", 200))
+CHAT_FLUSH_MAX_BATCH = int(os.environ.get("CHAT_FLUSH_MAX_BATCH", 500))
+# Exchanges held while MongoDB is unreachable; beyond this new ones are dropped (and logged)
+CHAT_WRITE_BEHIND_MAX_PENDING = int(os.environ.get("CHAT_WRITE_BEHIND_MAX_PENDING", 10000))
+# Exchange keys remembered per session so a retried session update is not applied twice
+RECENT_EXCHANGES = 20
+
+_seq_lock = threading.Lock()
+_last_seq = 0
+
+
+def next_seq(count=1):
+    """Reserve `count` consecutive message sequence numbers.
+
+    Sequence numbers are microseconds since the epoch, bumped past the last
+    one handed out, so they are monotonic within a process and roughly
+    time-ordered across workers; the unique (session_id, seq) index catches
+    the rare cross-worker collision.
+    """
+    global _last_seq
+    with _seq_lock:
+        first = max(_last_seq + 1, time.time_ns() // 1000)
+        _last_seq = first + count - 1
+    return first
+
+
+def _seq_from_timestamp(timestamp, offset):
+    if isinstance(timestamp, datetime):
+        return int(timestamp.timestamp() * 1_000_000) + offset
+    return offset
+
+
+def _is_duplicate_key(error):
+    return all(e.get("code") == 11000 for e in error.details.get("writeErrors", []))
+
+
+async def append_messages(session_id, messages, retries=3):
+    """Insert messages of a session as one document each, in order"""
+    collection = get_async_collection(CHAT_MESSAGES_COLLECTION)
+    inserted = []
+    for attempt in range(retries):
+        first = next_seq(len(messages))
+        docs = [
+            {**message, "session_id": session_id, "seq": first + offset}
+            for offset, message in enumerate(messages)
+        ]
+        try:
+            await collection.insert_many(docs, ordered=True)
+            return inserted + docs
+        except BulkWriteError as e:
+            # Another worker took the same seq for this session: retry the rest with fresh ones
+            if not _is_duplicate_key(e) or attempt == retries - 1:
+                raise
+            done = e.details.get("nInserted", 0)
+            inserted += docs[:done]
+            messages = messages[done:]
+
+
+async def get_messages(session_id, limit=DEFAULT_PAGE_SIZE, before=None):
+    """Return (messages in chronological order, cursor for the previous page or None).
+
+    The page holds the latest `limit` messages older than `before` (a seq);
+    it is read newest-first through the (session_id, seq) index, so the cost
+    does not depend on how long the session is.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {"session_id": session_id}
+    if before is not None:
+        query["seq"] = {"$lt": before}
+
+    collection = get_async_collection(CHAT_MESSAGES_COLLECTION)
+    docs = await collection.find(query, {"_id": 0, "session_id": 0}).sort("seq", -1).limit(limit + 1).to_list(length=limit + 1)
+
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    docs.reverse()
+    return docs, (docs[0]["seq"] if has_more else None)
+
+
+async def delete_messages(session_id):
+    collection = get_async_collection(CHAT_MESSAGES_COLLECTION)
+    result = await collection.delete_many({"session_id": session_id})
+    return result.deleted_count
+
+
+async def migrate_embedded_messages(session):
+    """Move a legacy session's embedded `messages` array into chat_messages.
+
+    Sequence numbers are derived from the message timestamps, so the moved
+    history sorts before anything written afterwards.
+    """
+    messages = session.get("messages")
+    if not messages:
+        return False
+
+    session_id = session["session_id"]
+    docs = [
+        {**message, "session_id": session_id, "seq": _seq_from_timestamp(message.get("timestamp"), offset)}
+        for offset, message in enumerate(messages)
+    ]
+    try:
+        await get_async_collection(CHAT_MESSAGES_COLLECTION).insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Partially migrated before; the already inserted messages are kept
+        if not _is_duplicate_key(e):
+            raise
+    # Only the migration that removes the array counts it, so racing readers do not double count
+    await get_async_collection(CHAT_SESSIONS_COLLECTION).update_one(
+        {"session_id": session_id, "messages": {"$exists": True}},
+        {"$unset": {"messages": ""}, "$inc": {"message_count": len(messages)}}
+    )
+    logger.info(f"Moved {len(messages)} embedded messages of session {session_id} to {CHAT_MESSAGES_COLLECTION}")
+    return True
+
+
+async def migrate_legacy_sessions(session_ids):
+    """Migrate whichever of `session_ids` still embed their messages, before new ones are written.
+
+    One indexed lookup; sessions already migrated (or created afterwards) do
+    not match it.
+    """
+    legacy = get_async_collection(CHAT_SESSIONS_COLLECTION).find(
+        {"session_id": {"$in": list(session_ids)}, "messages": {"$exists": True}},
+        {"_id": 0, "session_id": 1, "messages": 1}
+    )
+    async for session in legacy:
+        await migrate_embedded_messages(session)
+
+
+def encode_session_cursor(session):
+    """Opaque keyset cursor: position after `session` in (updated_at, session_id) descending order"""
+    raw = f"{session['updated_at'].isoformat()}|{session['session_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_session_cursor(cursor):
+    """Inverse of encode_session_cursor; raises ValueError for a malformed cursor"""
+    try:
+        updated_at, session_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(updated_at), session_id
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def owner_query(owner):
+    """Filter for the sessions `owner` may access; None (anonymous) matches unowned sessions only"""
+    return {"owner": owner}
+
+
+def session_list_query(owner, cursor=None):
+    """Filter for the sessions of `owner` that come after `cursor` in SESSION_LIST_SORT order"""
+    query = owner_query(owner)
+    if cursor:
+        updated_at, session_id = decode_session_cursor(cursor)
+        query["$or"] = [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "session_id": {"$lt": session_id}},
+        ]
+    return query
+
+
+async def list_sessions(owner, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """Return (one page of an owner's sessions, most recent first; cursor for the next page or None).
+
+    Served by the (owner, updated_at, session_id) index: every page is an
+    index range scan of `limit` entries, however many sessions exist.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    collection = get_async_collection(CHAT_SESSIONS_COLLECTION)
+    sessions = await collection.find(session_list_query(owner, cursor), SESSION_LIST_PROJECTION).sort(
+        SESSION_LIST_SORT
+    ).limit(limit + 1).to_list(length=limit + 1)
+
+    next_cursor = encode_session_cursor(sessions[limit - 1]) if len(sessions) > limit else None
+    return sessions[:limit], next_cursor
+
+
+def make_title(question):
+    """Session title from the first question: capitalized, cut at a word near 50 characters"""
+    title = question.strip()
+
+    if title and not title[0].isupper():
+        title = title[0].upper() + title[1:]
+
+    if len(title) > 50:
+        title = title[:50]
+        last_space = title.rfind(' ')
+        if last_space > 30:
+            title = title[:last_space] + "..."
+        else:
+            title = title + "..."
+    return title
+
+
+def session_update(question, added, now, exchange_key):
+    """Pipeline update: bump the message counter and updated_at, and title a still-untitled first exchange.
+
+    `exchange_key` (a seq reserved for the exchange) is recorded in the
+    session's `recent_exchanges`; an update whose key is already there
+    leaves the session unchanged, so retrying one whose outcome is unknown
+    cannot count the exchange twice.
+    """
+    count = {"$ifNull": ["$message_count", 0]}
+    recent = {"$ifNull": ["$recent_exchanges", []]}
+    applied = {"$in": [exchange_key, recent]}
+
+    def unless_applied(field, value):
+        return {"$cond": [applied, f"${field}", value]}
+
+    return [{
+        "$set": {
+            "title": unless_applied("title", {
+                "$cond": [
+                    {"$and": [{"$eq": [count, 0]}, {"$eq": ["$title", DEFAULT_TITLE]}]},
+                    {"$literal": make_title(question)},
+                    "$title"
+                ]
+            }),
+            "message_count": unless_applied("message_count", {"$add": [count, added]}),
+            "updated_at": unless_applied("updated_at", now),
+            "recent_exchanges": unless_applied("recent_exchanges", {
+                "$slice": [{"$concatArrays": [recent, [exchange_key]]}, -RECENT_EXCHANGES]
+            }),
+        }
+    }]
+
+
+def exchange_messages(question, response):
+    now = datetime.now()
+    return [
+        {
+            "role": "user",
+            "content": question,
+            "timestamp": now
+        },
+        {
+            "role": "assistant",
+            "content": response["response"],
+            "sources": response.get("sources", []),
+            "response_type": response.get("response_type", "general"),
+            "timestamp": datetime.now()
+        },
+    ]
+
+
+async def save_exchange(session_id, question, response):
+    """Store a question/answer pair: message insert and session update run concurrently, one round-trip each"""
+    messages = exchange_messages(question, response)
+    await migrate_legacy_sessions([session_id])
+    sessions = get_async_collection(CHAT_SESSIONS_COLLECTION)
+    inserted, result = await asyncio.gather(
+        append_messages(session_id, messages),
+        sessions.update_one(
+            {"session_id": session_id}, session_update(question, len(messages), datetime.now(), next_seq())
+        )
+    )
+    if result.matched_count == 0:
+        # Unknown session: do not keep orphaned messages
+        await get_async_collection(CHAT_MESSAGES_COLLECTION).delete_many(
+            {"session_id": session_id, "seq": {"$in": [doc["seq"] for doc in inserted]}}
+        )
+        logger.warning(f"Chat session {session_id} not found, exchange not saved")
+
+
+class ChatWriteBehind:
+    """Buffer exchanges in memory and write them with two bulk writes per flush.
+
+    Messages get their seq when buffered, so order is preserved no matter
+    how flushes are batched. A background task flushes every
+    CHAT_FLUSH_INTERVAL_MS (or when CHAT_FLUSH_MAX_BATCH exchanges are
+    pending); `stop` flushes what is left on shutdown. Reads of a session
+    with buffered exchanges flush first, so a client sees its own writes.
+    Operations that fail stay buffered and are retried by the next flush;
+    while CHAT_WRITE_BEHIND_MAX_PENDING exchanges are waiting, new ones are
+    dropped rather than buffered.
+    """
+
+    def __init__(self, interval_ms=CHAT_FLUSH_INTERVAL_MS, max_batch=CHAT_FLUSH_MAX_BATCH,
+                 max_pending=CHAT_WRITE_BEHIND_MAX_PENDING):
+        self.interval = interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._messages = []
+        self._updates = []
+        self._sessions = set()
+        self._task = None
+        self._wake = None
+        self._flush_lock = None
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.exchanges_written = 0
+        self.exchanges_dropped = 0
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, retries=3):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for attempt in range(retries):
+            await self.flush()
+            if not self._updates and not self._messages:
+                return
+            await asyncio.sleep(self.interval * 2 ** attempt)
+        logger.error(f"Chat write-behind stopped with {len(self._updates)} session updates and "
+                     f"{len(self._messages)} messages not written")
+
+    def submit(self, session_id, question, response):
+        if len(self._updates) >= self.max_pending:
+            self.exchanges_dropped += 1
+            logger.error(f"Chat write-behind full ({len(self._updates)} exchanges pending), "
+                         f"exchange of session {session_id} not saved")
+            return
+        messages = exchange_messages(question, response)
+        first = next_seq(len(messages))
+        self._messages.extend(
+            (session_id, InsertOne({**message, "session_id": session_id, "seq": first + offset}))
+            for offset, message in enumerate(messages)
+        )
+        self._updates.append((session_id, UpdateOne(
+            {"session_id": session_id}, session_update(question, len(messages), datetime.now(), first)
+        )))
+        self._sessions.add(session_id)
+        if len(self._updates) >= self.max_batch and self._wake is not None:
+            self._wake.set()
+
+    def pending(self, session_id):
+        return session_id in self._sessions
+
+    async def flush(self):
+        """Write the buffered exchanges; operations that failed go back into the buffer for the next flush"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._updates and not self._messages:
+                return
+            messages, updates = self._messages, self._updates
+            self._messages, self._updates, self._sessions = [], [], set()
+            try:
+                await migrate_legacy_sessions({session_id for session_id, _ in updates})
+            except Exception as e:
+                # Nothing written yet: keep the whole batch for the next flush
+                self.failed_flushes += 1
+                self._messages[:0] = messages
+                self._updates[:0] = updates
+                self._sessions.update(session_id for session_id, _ in messages + updates)
+                logger.error(f"Chat write-behind flush failed migrating legacy sessions: {e}")
+                return
+            message_result, update_result = await asyncio.gather(
+                get_async_collection(CHAT_MESSAGES_COLLECTION).bulk_write([op for _, op in messages], ordered=False),
+                get_async_collection(CHAT_SESSIONS_COLLECTION).bulk_write([op for _, op in updates], ordered=True),
+                return_exceptions=True
+            )
+            failed_messages = self._unwritten(messages, message_result, ordered=False)
+            failed_updates = self._unwritten(updates, update_result, ordered=True)
+            if failed_messages or failed_updates:
+                self.failed_flushes += 1
+                self._messages[:0] = failed_messages
+                self._updates[:0] = failed_updates
+                self._sessions.update(session_id for session_id, _ in failed_messages + failed_updates)
+                error = message_result if isinstance(message_result, Exception) else update_result
+                logger.error(f"Chat write-behind flush failed, {len(failed_messages)} messages and "
+                             f"{len(failed_updates)} session updates kept for retry: {error}")
+            self.flushes += 1
+            self.exchanges_written += len(updates) - len(failed_updates)
+
+    @staticmethod
+    def _unwritten(entries, result, ordered):
+        """Entries of a bulk write that did not succeed and should be retried"""
+        if not isinstance(result, Exception):
+            return []
+        if not isinstance(result, BulkWriteError):
+            # Unknown outcome (e.g. connection lost): retry everything; message inserts that did
+            # land are rejected by the unique (session_id, seq) index, session updates by their exchange key
+            return entries
+        errors = result.details.get("writeErrors", [])
+        if ordered:
+            return entries[errors[0]["index"]:] if errors else []
+        # A duplicate key means the message was stored by an earlier attempt
+        return [entries[e["index"]] for e in errors if e.get("code") != 11000]
+
+    def stats(self):
+        return {
+            "enabled": CHAT_WRITE_BEHIND,
+            "pending_exchanges": len(self._updates),
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "exchanges_written": self.exchanges_written,
+            "exchanges_dropped": self.exchanges_dropped,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+
+_write_behind = ChatWriteBehind()
+
+
+def get_chat_write_behind():
+    """Get the process-wide chat write-behind buffer"""
+    return _write_behind
@@ -0,0 +1,84 @@
+import os
+import re
+from dotenv import load_dotenv
+from modules.bm25_index import tokenize
+
+load_dotenv()
+
+# Prompt tokens available for retrieved text; the default matches the old 3 x 800-character snippets
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 600))
+# Longer sentences (tables, run-on PDF text) are cut into pieces of about this size
+MAX_SEGMENT_CHARS = 400
+CHARS_PER_TOKEN = 4
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for Llama-style tokenizers)"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def split_segments(text):
+    """Split chunk text into sentences, cutting overly long ones into bounded pieces"""
+    segments = []
+    for sentence in SENTENCE_BOUNDARY.split(" ".join(text.split())):
+        while len(sentence) > MAX_SEGMENT_CHARS:
+            cut = sentence.rfind(" ", 0, MAX_SEGMENT_CHARS)
+            cut = cut if cut > 0 else MAX_SEGMENT_CHARS
+            segments.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            segments.append(sentence)
+    return segments
+
+
+def pack_context(question, docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Pick the most relevant sentences of the ranked docs that fit the token budget.
+
+    Sentences are scored by the share of question terms they contain,
+    weighted by the similarity of their chunk; text repeated by the
+    splitter's chunk overlap is kept only once. Selected sentences are
+    emitted in reading order per chunk, with "..." marking skipped text.
+
+    Returns (context, docs that contributed text, tokens used).
+    """
+    terms = set(tokenize(question or ""))
+    seen = set()
+    candidates = []
+    for doc_rank, doc in enumerate(docs):
+        weight = doc.get("similarity") or 1.0 / (doc_rank + 1)
+        for position, segment in enumerate(split_segments(doc.get("content", ""))):
+            key = segment.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            overlap = len(terms & set(tokenize(segment))) / len(terms) if terms else 0.0
+            # Ties (e.g. no question terms) fall back to rank, then reading order
+            candidates.append((-(weight * (0.5 + overlap)), doc_rank, position, segment))
+    candidates.sort()
+
+    selected = {}
+    used = 0
+    for _, doc_rank, position, segment in candidates:
+        cost = estimate_tokens(segment) + 1
+        if used + cost > token_budget:
+            continue
+        selected.setdefault(doc_rank, []).append((position, segment))
+        used += cost
+
+    blocks = []
+    contributing = []
+    for doc_rank in sorted(selected):
+        parts = []
+        previous = None
+        for position, segment in sorted(selected[doc_rank]):
+            if previous is not None and position != previous + 1:
+                parts.append("...")
+            parts.append(segment)
+            previous = position
+        blocks.append(" ".join(parts))
+        contributing.append(docs[doc_rank])
+
+    context = "\n\n".join(blocks)
+    return context, contributing, estimate_tokens(context)
@@ -0,0 +1,168 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+import numpy as np
+from dotenv import load_dotenv
+from modules.bm25_index import tokenize
+from modules.embedding_cache import embed_query_cached
+from modules.vector_index import normalize_vectors
+
+load_dotenv()
+
+CONVERSATION_MAX_SESSIONS = int(os.environ.get("CONVERSATION_MAX_SESSIONS", 5000))
+CONVERSATION_TTL_SECONDS = float(os.environ.get("CONVERSATION_TTL_SECONDS", 1800))
+CONVERSATION_MAX_TURNS = int(os.environ.get("CONVERSATION_MAX_TURNS", 4))
+# Share of the previous turn's embedding mixed into a follow-up's query embedding
+FOLLOWUP_BLEND_WEIGHT = float(os.environ.get("FOLLOWUP_BLEND_WEIGHT", 0.35))
+# A question is a follow-up only when its embedding is this close to the previous turn's, and it is
+# either short (at most FOLLOWUP_MAX_TERMS content words) or opens like a continuation
+FOLLOWUP_MAX_TERMS = 3
+FOLLOWUP_MIN_SIMILARITY = float(os.environ.get("FOLLOWUP_MIN_SIMILARITY", 0.5))
+
+# Openers that also start plenty of standalone questions ("is it", "this", "and") are left out
+FOLLOWUP_PATTERN = re.compile(
+    r"^(what about|how about|also|what if|same for|does it|can it|are they|do they|they|them|those)\b",
+    re.IGNORECASE
+)
+
+
+@dataclass
+class Turn:
+    # The standalone question a chain of follow-ups refers back to
+    topic: str
+    embedding: np.ndarray
+    chunk_ids: list
+    at: float
+
+
+@dataclass
+class ConversationContext:
+    """How to retrieve and ask for one question, given its session's recent turns"""
+    question: str
+    search_text: str
+    query_embedding: np.ndarray
+    topic: str
+    prior_chunk_ids: list = field(default_factory=list)
+    follow_up: bool = False
+
+
+def is_follow_up(question, similarity=None):
+    """Cheap test for questions that only make sense after the previous turn.
+
+    The question's embedding must be at least FOLLOWUP_MIN_SIMILARITY to
+    the previous turn's (`similarity`), and the question must either open
+    like a continuation ("what about ...", "does it ...") or be short.
+    Neither wording nor length alone is enough: "parvo symptoms" is a
+    complete question, and so is "does it hurt dogs to eat grapes?" when it
+    has nothing to do with the previous turn.
+    """
+    if similarity is None or similarity < FOLLOWUP_MIN_SIMILARITY:
+        return False
+    text = question.strip()
+    return bool(FOLLOWUP_PATTERN.match(text)) or len(tokenize(text)) <= FOLLOWUP_MAX_TERMS
+
+
+class ConversationStateCache:
+    """Recent turns per chat session (topic, query embedding, retrieved chunk ids).
+
+    Bounded by an LRU over sessions plus a TTL on inactivity, so memory stays
+    flat with thousands of active sessions. State is per worker process; a
+    session served by another worker simply starts without context.
+    """
+
+    def __init__(self, max_sessions=CONVERSATION_MAX_SESSIONS, ttl_seconds=CONVERSATION_TTL_SECONDS,
+                 max_turns=CONVERSATION_MAX_TURNS, blend_weight=FOLLOWUP_BLEND_WEIGHT):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self.blend_weight = blend_weight
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.follow_ups = 0
+        self.standalone = 0
+        self.evictions = 0
+
+    def resolve(self, session_id, question, embeddings_model):
+        """Build the retrieval context for a question.
+
+        A follow-up gets the topic of its session appended to the BM25 text
+        and to the question sent to the LLM, an embedding blended towards the
+        previous turn's, and the previous turn's chunks as extra candidates.
+        No LLM call is involved.
+        """
+        query_embedding = normalize_vectors(embed_query_cached(question, embeddings_model)).reshape(-1)
+        previous = self._last_turn(session_id)
+        if previous is None or not is_follow_up(question, float(query_embedding @ previous.embedding)):
+            self.standalone += 1
+            return ConversationContext(question, question, query_embedding, topic=question)
+
+        self.follow_ups += 1
+        blended = normalize_vectors(
+            (1 - self.blend_weight) * query_embedding + self.blend_weight * previous.embedding
+        ).reshape(-1)
+        return ConversationContext(
+            question=f"{question} (follow-up to: {previous.topic})",
+            search_text=f"{question} {previous.topic}",
+            query_embedding=blended,
+            topic=previous.topic,
+            prior_chunk_ids=list(previous.chunk_ids),
+            follow_up=True,
+        )
+
+    def record(self, session_id, context, chunk_ids):
+        """Remember a finished turn; a follow-up keeps its topic and blended embedding"""
+        if not session_id or context is None:
+            return
+        turn = Turn(context.topic, context.query_embedding, list(chunk_ids), time.time())
+        with self._lock:
+            turns = self._sessions.pop(session_id, None) or deque(maxlen=self.max_turns)
+            turns.append(turn)
+            self._sessions[session_id] = turns
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "follow_ups": self.follow_ups,
+                "standalone": self.standalone,
+                "evictions": self.evictions,
+            }
+
+    def _last_turn(self, session_id):
+        if not session_id:
+            return None
+        with self._lock:
+            turns = self._sessions.get(session_id)
+            if not turns:
+                return None
+            if time.time() - turns[-1].at > self.ttl_seconds:
+                del self._sessions[session_id]
+                self.evictions += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            return turns[-1]
+
+
+_conversation_state = None
+_conversation_state_lock = threading.Lock()
+
+
+def get_conversation_state():
+    """Get the process-wide conversation state cache"""
+    global _conversation_state
+    if _conversation_state is None:
+        with _conversation_state_lock:
+            if _conversation_state is None:
+                _conversation_state = ConversationStateCache()
+    return _conversation_state
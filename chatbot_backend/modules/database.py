@@ -1,5 +1,8 @@
 import os
-from pymongo import MongoClient
+import threading
+import time
+from pymongo import MongoClient, monitoring
+from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from logger import logger
 
@@ -8,15 +11,122 @@ load_dotenv()
 MONGODB_URL = os.environ.get("MONGODB_URL", "mongodb://localhost:27017/")
 DATABASE_NAME = os.environ.get("DATABASE_NAME", "ragbot_db")
 COLLECTION_NAME = os.environ.get("COLLECTION_NAME", "documents")
+# One record per ingested file (path, file hash)
+SOURCES_COLLECTION = "sources"
+# Chat sessions, and their messages as one document per message keyed by (session_id, seq)
+CHAT_SESSIONS_COLLECTION = "chat_sessions"
+CHAT_MESSAGES_COLLECTION = "chat_messages"
+
+# Connection pool settings shared by the sync and async clients
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collect connection pool statistics (checked-out connections, checkout wait time)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.connections_open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connections_open": self.connections_open,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_wait_ms": 1000 * self.total_wait_seconds / self.checkouts if self.checkouts else 0.0,
+                "max_wait_ms": 1000 * self.max_wait_seconds,
+            }
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        waited = time.perf_counter() - started if started is not None else 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkouts += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+_client = None
+_async_client = None
+_collections = {}
+_async_collections = {}
+_client_lock = threading.Lock()
+_sync_pool_stats = PoolStatsListener()
+_async_pool_stats = PoolStatsListener()
+
+
+def _client_options(listener):
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "event_listeners": [listener],
+    }
 
 def get_mongo_client():
-    """Get MongoDB client connection"""
-    try:
-        client = MongoClient(MONGODB_URL)
-        return client
-    except Exception as e:
-        logger.error(f"Error connecting to MongoDB: {e}")
-        raise
+    """Get the shared MongoDB client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                try:
+                    _client = MongoClient(MONGODB_URL, **_client_options(_sync_pool_stats))
+                except Exception as e:
+                    logger.error(f"Error connecting to MongoDB: {e}")
+                    raise
+    return _client
 
 def get_database():
     """Get MongoDB database"""
@@ -25,32 +135,82 @@ def get_database():
 
 def get_collection(collection_name=COLLECTION_NAME):
     """Get MongoDB collection"""
-    db = get_database()
-    return db[collection_name]
+    collection = _collections.get(collection_name)
+    if collection is None:
+        collection = _collections.setdefault(collection_name, get_database()[collection_name])
+    return collection
+
+def get_async_client():
+    """Get the shared motor client used by async request handlers"""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncIOMotorClient(MONGODB_URL, **_client_options(_async_pool_stats))
+    return _async_client
+
+def get_async_collection(collection_name=COLLECTION_NAME):
+    """Get MongoDB collection for use with await"""
+    collection = _async_collections.get(collection_name)
+    if collection is None:
+        collection = _async_collections.setdefault(
+            collection_name, get_async_client()[DATABASE_NAME][collection_name]
+        )
+    return collection
+
+def pool_stats():
+    """Connection pool statistics for monitoring"""
+    return {
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "sync": _sync_pool_stats.stats(),
+        "async": _async_pool_stats.stats(),
+    }
 
 def create_indexes():
     """Create indexes for better performance"""
     try:
         collection = get_collection()
-        
+
         # Create text index for full-text search
         collection.create_index([("content", "text")])
-        
+
         # Create index on source field
         collection.create_index("source")
-        
-        # Create index on embeddings if using vector search
-        collection.create_index("embeddings")
-        
+
+        # Vectors are searched in process; a B-tree over the array only costs space
+        if "embeddings_1" in collection.index_information():
+            collection.drop_index("embeddings_1")
+
+        sources = get_collection(SOURCES_COLLECTION)
+        sources.create_index("source", unique=True)
+        sources.create_index("file_hash")
+        # Admin file listing, newest first per document type
+        sources.create_index([("document_type", 1), ("created_at", -1)])
+
+        chat_sessions = get_collection(CHAT_SESSIONS_COLLECTION)
+        chat_sessions.create_index("session_id", unique=True)
+        # Keyset pagination of an owner's sessions, most recently updated first
+        chat_sessions.create_index([("owner", 1), ("updated_at", -1), ("session_id", -1)])
+        chat_messages = get_collection(CHAT_MESSAGES_COLLECTION)
+        chat_messages.create_index([("session_id", 1), ("seq", 1)], unique=True)
+
         logger.info("MongoDB indexes created successfully")
     except Exception as e:
         logger.error(f"Error creating indexes: {e}")
 
 def close_connection():
-    """Close MongoDB connection"""
+    """Close the shared MongoDB clients"""
+    global _client, _async_client
     try:
-        client = get_mongo_client()
-        client.close()
+        with _client_lock:
+            if _client is not None:
+                _client.close()
+            if _async_client is not None:
+                _async_client.close()
+            _client = None
+            _async_client = None
+            _collections.clear()
+            _async_collections.clear()
         logger.info("MongoDB connection closed")
     except Exception as e:
-        logger.error(f"Error closing MongoDB connection: {e}")
\ No newline at end of file
+        logger.error(f"Error closing MongoDB connection: {e}")
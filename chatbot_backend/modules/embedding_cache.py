@@ -0,0 +1,153 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+QUERY_CACHE_MAX_BYTES = int(os.environ.get("QUERY_CACHE_MAX_BYTES", 32 * 2**20))
+# Optional SQLite file for the on-disk tier, e.g. ./cache/query_embeddings.db
+QUERY_CACHE_PATH = os.environ.get("QUERY_CACHE_PATH")
+
+# Rough per-entry bookkeeping cost (OrderedDict node, key object, array header)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_query(text):
+    """Canonical cache key: lower-case, collapsed whitespace, no trailing punctuation"""
+    text = " ".join(text.lower().split())
+    return re.sub(r"[\s?!.]+$", "", text)
+
+
+def cache_key(query, model_name):
+    """Cache key of a query for one embedding model; vectors of different models never mix"""
+    return f"{model_name}|{normalize_query(query)}"
+
+
+class QueryEmbeddingCache:
+    """LRU cache of query embeddings with an optional SQLite tier that survives restarts.
+
+    Keys carry the embedding model name (see cache_key), so after a change of
+    EMBEDDING_MODEL_NAME the on-disk entries of the old model are never served.
+    """
+
+    def __init__(self, max_bytes=QUERY_CACHE_MAX_BYTES, disk_path=QUERY_CACHE_PATH):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+            )
+            self._db.commit()
+            logger.info(f"Query embedding disk cache at {disk_path}")
+
+    def get(self, key):
+        """Return the cached vector for a normalized query, or None"""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)",
+                    (key, vector.tobytes())
+                )
+                self._db.commit()
+
+    def record_encode(self, seconds):
+        """Account encoder time spent on a miss"""
+        with self._lock:
+            self.encode_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            avg_encode = self.encode_seconds / self.misses if self.misses else 0.0
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "encode_seconds": round(self.encode_seconds, 3),
+                "encode_seconds_saved": round((self.hits + self.disk_hits) * avg_encode, 3),
+            }
+
+    def _remember(self, key, vector):
+        if key in self._entries:
+            self._bytes -= self._entry_size(key, self._entries.pop(key))
+        self._entries[key] = vector
+        self._bytes += self._entry_size(key, vector)
+        while self._bytes > self.max_bytes and self._entries:
+            old_key, old_vector = self._entries.popitem(last=False)
+            self._bytes -= self._entry_size(old_key, old_vector)
+
+    @staticmethod
+    def _entry_size(key, vector):
+        return len(key) + vector.nbytes + ENTRY_OVERHEAD_BYTES
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    """Get the process-wide query embedding cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryEmbeddingCache()
+    return _cache
+
+
+def embed_query_cached(query, embeddings_model):
+    """Embed a query through the cache, encoding only on a miss"""
+    cache = get_query_cache()
+    key = cache_key(query, getattr(embeddings_model, "model_name", ""))
+    vector = cache.get(key)
+    if vector is not None:
+        return vector
+
+    start = time.perf_counter()
+    vector = np.asarray(embeddings_model.embed_query(query), dtype=np.float32)
+    cache.record_encode(time.perf_counter() - start)
+    cache.put(key, vector)
+    return vector
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from langchain_huggingface import HuggingFaceEmbeddings
+from logger import logger
+
+load_dotenv()
+
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME", "all-MiniLM-L12-v2")
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 64))
+# Ingest batches are encoded in slices of this size, releasing the model between slices
+# so query embeddings do not wait behind a whole batch
+EMBED_LOCK_BATCH_SIZE = int(os.environ.get("EMBED_LOCK_BATCH_SIZE", 8))
+
+
+class EmbeddingProvider:
+    """Process-wide embedding model shared by the retriever and the ingest path"""
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, batch_size=EMBED_BATCH_SIZE):
+        start = time.perf_counter()
+        self.model_name = model_name
+        self._embeddings = HuggingFaceEmbeddings(
+            model_name=model_name,
+            encode_kwargs={"batch_size": batch_size}
+        )
+        # The tokenizer is not safe to call from several threads at once
+        self._lock = threading.Lock()
+        self.load_seconds = time.perf_counter() - start
+        self.memory_bytes = self._model_memory()
+        self.warmed_up = False
+        logger.info(f"Loaded embedding model {model_name} in {self.load_seconds:.2f}s "
+                    f"({self.memory_bytes / 2**20:.1f} MiB of weights)")
+
+    @property
+    def client(self):
+        """The underlying SentenceTransformer model"""
+        return self._embeddings._client
+
+    def embed_query(self, text):
+        with self._lock:
+            return self._embeddings.embed_query(text)
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), EMBED_LOCK_BATCH_SIZE):
+            with self._lock:
+                vectors.extend(self._embeddings.embed_documents(texts[start:start + EMBED_LOCK_BATCH_SIZE]))
+        return vectors
+
+    def warmup(self):
+        """Run a dummy encode so the first real request does not pay for lazy init"""
+        start = time.perf_counter()
+        self.embed_query("warmup")
+        self.warmed_up = True
+        logger.info(f"Embedding model warmed up in {time.perf_counter() - start:.2f}s")
+
+    def stats(self):
+        return {
+            "model_name": self.model_name,
+            "load_seconds": round(self.load_seconds, 3),
+            "memory_bytes": self.memory_bytes,
+            "warmed_up": self.warmed_up,
+        }
+
+    def _model_memory(self):
+        try:
+            tensors = list(self.client.parameters()) + list(self.client.buffers())
+            return sum(t.numel() * t.element_size() for t in tensors)
+        except Exception as e:
+            logger.warning(f"Could not measure embedding model memory: {e}")
+            return 0
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_embeddings():
+    """Get the process-wide embedding provider, loading the model on first use"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = EmbeddingProvider()
+    return _provider
+
+
+def embedding_stats():
+    """Report load time and memory of the embedding model without loading it"""
+    if _provider is None:
+        return {"model_name": EMBEDDING_MODEL_NAME, "loaded": False}
+    return {"loaded": True, **_provider.stats()}
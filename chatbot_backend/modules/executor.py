@@ -0,0 +1,23 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bound on threads doing embedding, PDF parsing and blocking MongoDB work
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking or CPU-bound call on the bounded executor without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+def shutdown_executor():
+    """Wait for in-flight blocking work and stop the executor"""
+    _executor.shutdown(wait=True)
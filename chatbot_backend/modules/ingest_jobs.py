@@ -0,0 +1,256 @@
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from modules.database import get_collection
+from modules.load_vectorstore import hash_file, find_ingested_file, ingest_file_chunks
+from modules.pdf_parsing import iter_pdf_chunks
+from logger import logger
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 2))
+JOBS_COLLECTION = "ingest_jobs"
+# A job belongs to the worker holding its lease; the owner renews it while alive
+INGEST_LEASE_SECONDS = float(os.environ.get("INGEST_LEASE_SECONDS", 60))
+PENDING_STATUSES = ["queued", "running"]
+
+
+class IngestJobManager:
+    """Runs PDF ingestion in the background and persists per-stage progress.
+
+    Ingest is incremental by content hash, so after a restart a job resumes
+    with the chunks already committed to MongoDB counted as unchanged
+    instead of embedding them again.
+
+    With several workers, a job is run by the one holding its lease (`owner`,
+    `lease_expires_at`), taken with an atomic find_one_and_update. Each
+    manager renews the leases of its jobs every third of
+    INGEST_LEASE_SECONDS; jobs whose lease expired (their worker died) are
+    claimed and resumed by whichever worker notices first.
+    """
+
+    def __init__(self, max_workers=INGEST_WORKERS, lease_seconds=INGEST_LEASE_SECONDS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = get_collection(JOBS_COLLECTION)
+        self._jobs.create_index("job_id", unique=True)
+        self._jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def start(self):
+        """Resume orphaned jobs and keep renewing this worker's leases in the background"""
+        self.resume_pending()
+        self._heartbeat = threading.Thread(target=self._renew_leases, name="ingest-lease", daemon=True)
+        self._heartbeat.start()
+
+    def submit(self, file_paths, doc_type="pdf"):
+        """Persist a new job for already-saved files and queue it"""
+        job_id = str(uuid.uuid4())
+        now = datetime.now()
+        self._jobs.insert_one({
+            "job_id": job_id,
+            "status": "queued",
+            "owner": self.owner,
+            "lease_expires_at": self._lease_deadline(),
+            "doc_type": doc_type,
+            "files": [
+                {
+                    "filename": os.path.basename(path),
+                    "path": path,
+                    "status": "queued",
+                    "pages_parsed": 0,
+                    "chunks": 0,
+                    "embedded": 0,
+                    "inserted": 0,
+                    "added": 0,
+                    "unchanged": 0,
+                    "removed": 0,
+                }
+                for path in file_paths
+            ],
+            "summary": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        })
+        self._executor.submit(self._run, job_id)
+        logger.info(f"Queued ingest job {job_id} for {len(file_paths)} files")
+        return job_id
+
+    def get(self, job_id):
+        return self._jobs.find_one({"job_id": job_id}, {"_id": 0})
+
+    def resume_pending(self):
+        """Claim and re-queue unfinished jobs whose owner's lease has expired"""
+        expired = [job["job_id"] for job in self._jobs.find(
+            {"status": {"$in": PENDING_STATUSES}, **self._lease_expired()}, {"job_id": 1}
+        )]
+        # Another worker may claim some of them first; only the claimed ones run here
+        resumed = [job_id for job_id in expired if self._claim(job_id) is not None]
+        for job_id in resumed:
+            self._executor.submit(self._run, job_id)
+        if resumed:
+            logger.info(f"Resuming {len(resumed)} interrupted ingest jobs")
+        return len(resumed)
+
+    def shutdown(self):
+        # Leases are left to expire, so another worker resumes interrupted jobs
+        # only once this process can no longer be writing to them
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job_id):
+        job = self._claim(job_id, status="running")
+        if job is None:
+            logger.info(f"Ingest job {job_id} is finished or owned by another worker, not running it")
+            return
+
+        try:
+            remaining = []
+            for i, file_info in enumerate(job["files"]):
+                if file_info["status"] in ("completed", "unchanged", "duplicate"):
+                    continue
+                path = file_info["path"]
+                file_hash = hash_file(path)
+
+                # Identical bytes were ingested before: skip without parsing
+                ingested = find_ingested_file(file_hash)
+                if ingested is not None:
+                    status = "unchanged" if ingested["source"] == path else "duplicate"
+                    self._set(job_id, {f"files.{i}.status": status, f"files.{i}.duplicate_of": ingested["source"]})
+                    logger.info(f"Job {job_id}: skipping {path}, {status} ({ingested['source']})")
+                    continue
+                remaining.append((i, path, file_hash))
+            index_of = {path: (i, file_hash) for i, path, file_hash in remaining}
+
+            # One ordered parse stream for all files, so the next file is already
+            # being parsed while the current one is embedded
+            parsed = iter_pdf_chunks([path for _, path, _ in remaining])
+            for path, ranges in groupby(parsed, key=lambda result: result[0]):
+                if self._claim(job_id, status="running") is None:
+                    # Lease lost (e.g. this worker stalled): the new owner finishes the job
+                    logger.warning(f"Ingest job {job_id} lost its lease, stopping")
+                    return
+                i, file_hash = index_of.pop(path)
+                self._ingest_file(job_id, job["doc_type"], i, path, file_hash, ranges)
+
+            # Files without any pages produce no parse results
+            for i, _ in index_of.values():
+                self._set(job_id, {f"files.{i}.status": "completed"})
+
+            self._set(job_id, {"status": "completed", "summary": self._summarize(job_id), "lease_expires_at": None})
+            logger.info(f"Ingest job {job_id} completed")
+        except Exception as e:
+            if self._stopped.is_set() or isinstance(e, CancelledError):
+                # Interrupted by shutdown (e.g. parse futures cancelled): stay running
+                # with the lease, so a worker resumes the job once the lease expires
+                logger.info(f"Ingest job {job_id} interrupted by shutdown, it will be resumed")
+                return
+            logger.error(f"Ingest job {job_id} failed: {e}", exc_info=True)
+            self._set(job_id, {"status": "failed", "error": str(e), "lease_expires_at": None})
+
+    def _ingest_file(self, job_id, doc_type, index, path, file_hash, ranges):
+        prefix = f"files.{index}"
+        self._set(job_id, {
+            f"{prefix}.status": "processing",
+            f"{prefix}.pages_parsed": 0,
+            f"{prefix}.chunks": 0,
+            f"{prefix}.embedded": 0,
+            f"{prefix}.inserted": 0,
+        })
+
+        def on_progress(stage, count):
+            self._jobs.update_one(
+                {"job_id": job_id},
+                {"$inc": {f"{prefix}.{stage}": count}, "$set": {"updated_at": datetime.now()}}
+            )
+
+        def chunk_stream():
+            for _, pages, chunks in ranges:
+                self._jobs.update_one(
+                    {"job_id": job_id},
+                    {"$inc": {f"{prefix}.pages_parsed": pages, f"{prefix}.chunks": len(chunks)}}
+                )
+                yield from chunks
+
+        summary = ingest_file_chunks(path, file_hash, chunk_stream(), doc_type, on_progress=on_progress)
+        self._set(job_id, {
+            f"{prefix}.status": "completed",
+            **{f"{prefix}.{key}": value for key, value in summary.items()}
+        })
+
+    def _summarize(self, job_id):
+        """Totals of added/unchanged/removed chunks and skipped files for the admin"""
+        files = self.get(job_id)["files"]
+        summary = {key: sum(f.get(key, 0) for f in files) for key in ("added", "unchanged", "removed")}
+        summary["files_skipped"] = sum(f["status"] in ("unchanged", "duplicate") for f in files)
+        return summary
+
+    def _claim(self, job_id, status=None):
+        """Atomically take (or extend) the lease of an unfinished job; None if someone else holds it"""
+        now = datetime.now()
+        fields = {"owner": self.owner, "lease_expires_at": self._lease_deadline(now), "updated_at": now}
+        if status is not None:
+            fields["status"] = status
+        return self._jobs.find_one_and_update(
+            {
+                "job_id": job_id,
+                "status": {"$in": PENDING_STATUSES},
+                "$or": [{"owner": self.owner}, self._lease_expired(now)],
+            },
+            {"$set": fields},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _renew_leases(self):
+        interval = self.lease_seconds / 3
+        while not self._stopped.wait(interval):
+            try:
+                self._jobs.update_many(
+                    {"owner": self.owner, "status": {"$in": PENDING_STATUSES}},
+                    {"$set": {"lease_expires_at": self._lease_deadline()}}
+                )
+                # Pick up jobs of workers that died since startup
+                self.resume_pending()
+            except Exception as e:
+                logger.error(f"Error renewing ingest job leases: {e}")
+
+    def _lease_deadline(self, now=None):
+        return (now or datetime.now()) + timedelta(seconds=self.lease_seconds)
+
+    @staticmethod
+    def _lease_expired(now=None):
+        # Jobs persisted before leases existed have none and count as expired
+        return {"$or": [
+            {"lease_expires_at": None},
+            {"lease_expires_at": {"$lt": now or datetime.now()}},
+        ]}
+
+    def _set(self, job_id, fields):
+        self._jobs.update_one(
+            {"job_id": job_id},
+            {"$set": {**fields, "updated_at": datetime.now()}}
+        )
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_ingest_manager():
+    """Get the process-wide ingest job manager"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = IngestJobManager()
+    return _manager
@@ -2,24 +2,44 @@ import os
 from dotenv import load_dotenv
 from langchain_core.prompts import PromptTemplate
 from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings  
+from modules.embeddings import get_embeddings
 from modules.load_vectorstore import similarity_search
+from modules.executor import run_blocking
+from modules.reranker import get_reranker, RERANK_ENABLED, RERANK_CANDIDATES
 from logger import logger
 
 load_dotenv()
 
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+# "vector" or "hybrid" (vector + BM25 fused with reciprocal rank fusion)
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "vector").lower()
 
 class HybridRetriever:
-    def __init__(self, collection, embeddings_model, k=3):
+    def __init__(self, collection, embeddings_model, k=3, hybrid=RETRIEVAL_MODE == "hybrid",
+                 rerank=RERANK_ENABLED, rerank_candidates=RERANK_CANDIDATES):
         self.collection = collection
         self.embeddings_model = embeddings_model
         self.k = k
+        self.hybrid = hybrid
+        # Over-fetch candidates for the cross-encoder, which then keeps the top k
+        self.rerank = rerank
+        self.rerank_candidates = max(rerank_candidates, k)
     
-    def get_relevant_documents(self, query):
-        """Retrieve relevant documents from MongoDB, return None if no good matches"""
+    def get_relevant_documents(self, query, filters=None, conversation=None):
+        """Retrieve relevant documents from MongoDB, return None if no good matches.
+
+        `filters` restrict the search by source, document_type, page or metadata;
+        `conversation` (a ConversationContext) resolves follow-up questions.
+        """
         try:
-            results = similarity_search(query, self.collection, self.embeddings_model, self.k)
+            results = similarity_search(
+                conversation.search_text if conversation else query,
+                self.collection, self.embeddings_model,
+                self.rerank_candidates if self.rerank else self.k,
+                hybrid=self.hybrid, filters=filters,
+                query_embedding=conversation.query_embedding if conversation else None,
+                prior_ids=conversation.prior_chunk_ids if conversation else None
+            )
             
             # Check if we have any results and if they have good similarity scores
             if not results:
@@ -33,11 +53,25 @@ class HybridRetriever:
                 if similarity > 0.1:  
                     good_results.append(result)
             
+            if self.rerank and good_results:
+                good_results = self._rerank(conversation.question if conversation else query, good_results)
+
             return good_results if good_results else None
             
         except Exception as e:
             logger.error(f"Error in document retrieval: {e}")
             return None
+    
+    def _rerank(self, query, results):
+        try:
+            return get_reranker().rerank(query, results, self.k)
+        except Exception as e:
+            logger.error(f"Reranking failed, keeping retrieval order: {e}")
+            return results[:self.k]
+
+    async def aget_relevant_documents(self, query, filters=None, conversation=None):
+        """Async variant: embedding and MongoDB reads run on the bounded executor"""
+        return await run_blocking(self.get_relevant_documents, query, filters, conversation)
 
 def get_llm_chain(collection):
     """Create LLM chain with hybrid approach (documents + general knowledge)"""
@@ -50,8 +84,8 @@ def get_llm_chain(collection):
             temperature=0.1
         )
         
-        # Initialize embeddings
-        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L12-v2")
+        # Shared embedding model
+        embeddings = get_embeddings()
         
         # Create hybrid retriever
         retriever = HybridRetriever(collection, embeddings, k=3)
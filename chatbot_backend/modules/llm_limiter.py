@@ -0,0 +1,169 @@
+import asyncio
+import os
+import random
+import time
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+# Groq calls running at once, and requests allowed to wait for a slot
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", 8))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", 32))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", 10))
+# Retries on HTTP 429 with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+LLM_RETRY_BASE_SECONDS = float(os.environ.get("LLM_RETRY_BASE_SECONDS", 0.5))
+LLM_RETRY_MAX_SECONDS = float(os.environ.get("LLM_RETRY_MAX_SECONDS", 8))
+
+
+class LLMOverloaded(Exception):
+    """The LLM cannot take the request now (queue full, queue timeout or rate limited)"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_rate_limited(error):
+    """True for Groq/OpenAI-style 429 errors"""
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class AdmissionController:
+    """Bound concurrent LLM calls, queue a limited number of waiters and shed the rest.
+
+    A request first takes a slot (at most `max_in_flight` run at once). If
+    all slots are busy it waits in a FIFO queue of at most `max_queue`
+    requests for up to `queue_timeout` seconds; beyond that it is rejected
+    with LLMOverloaded, which the API turns into a 503. Rate-limit errors are
+    retried while holding the slot, which slows the whole worker down instead
+    of letting every request hit the limit again.
+    """
+
+    def __init__(self, max_in_flight=LLM_MAX_IN_FLIGHT, max_queue=LLM_MAX_QUEUE,
+                 queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS, max_retries=LLM_MAX_RETRIES):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self._semaphore = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def saturated(self):
+        """Whether a new request would be rejected right away"""
+        return self.in_flight + self.waiting >= self.max_in_flight + self.max_queue
+
+    async def ainvoke(self, chain, inputs):
+        """`chain.ainvoke(inputs)` under admission control, retrying on 429"""
+        await self._acquire()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return await chain.ainvoke(inputs)
+                except Exception as e:
+                    await self._backoff_or_raise(e, attempt)
+        finally:
+            self._release()
+
+    async def astream(self, chain, inputs):
+        """`chain.astream(inputs)` under admission control; retries only before the first chunk"""
+        await self._acquire()
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = False
+                try:
+                    async for chunk in chain.astream(inputs):
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    if started:
+                        raise
+                    await self._backoff_or_raise(e, attempt)
+        finally:
+            self._release()
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected,
+            "rejected_queue_timeout": self.timed_out,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "avg_wait_ms": 1000 * self.total_wait_seconds / self.admitted if self.admitted else 0.0,
+            "max_wait_ms": 1000 * self.max_wait_seconds,
+        }
+
+    async def _acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        if self.saturated():
+            self.rejected += 1
+            raise LLMOverloaded("LLM queue is full")
+
+        start = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise LLMOverloaded(f"Timed out after {self.queue_timeout:.0f}s waiting for the LLM")
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - start
+        self.in_flight += 1
+        self.admitted += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def _backoff_or_raise(self, error, attempt):
+        if not is_rate_limited(error):
+            raise error
+        self.rate_limited += 1
+        retry_after = _retry_after(error)
+        if attempt >= self.max_retries:
+            raise LLMOverloaded("LLM rate limit exceeded", retry_after=retry_after or 1) from error
+
+        delay = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, min(retry_after, LLM_RETRY_MAX_SECONDS))
+        self.retries += 1
+        logger.warning(f"LLM rate limited, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+_controller = AdmissionController()
+
+
+def get_llm_limiter():
+    """Get the process-wide LLM admission controller"""
+    return _controller
@@ -1,13 +1,24 @@
 import os
+import re
 import time
+import hashlib
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from modules.database import get_collection
+from modules.database import get_collection, SOURCES_COLLECTION
+from modules.embeddings import get_embeddings, EMBED_BATCH_SIZE
+from modules.vector_index import get_vector_index
+from modules.vector_codec import encode_embedding
+from modules.vector_snapshot import get_snapshot_store, load_vector_index
+from modules.embedding_cache import embed_query_cached
+from modules.answer_cache import get_answer_cache
+from modules.bm25_index import get_bm25_index, hybrid_search
+from modules.metadata_index import get_metadata_index, filters_to_mongo_query
 from logger import logger
 
 UPLOAD_DIR = "./uploaded_documents"
@@ -15,33 +26,104 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 load_dotenv()
 
-def load_vectorstore(uploaded_files):
-    """Load PDF documents into MongoDB vectorstore"""
-    file_paths = []
+# Spread encoding over all cores on CPU-only hosts
+EMBED_MULTI_PROCESS = os.environ.get("EMBED_MULTI_PROCESS", "false").lower() == "true"
 
-    # Save uploaded files
+def save_uploaded_files(uploaded_files):
+    """Save uploaded files to the upload directory and return their paths"""
+    file_paths = []
     for file in uploaded_files:
         save_path = Path(UPLOAD_DIR) / file.filename
         with open(save_path, "wb") as f:
             f.write(file.file.read())
         file_paths.append(str(save_path))
         logger.info(f"Saved PDF file: {save_path}")
+    return file_paths
 
-    # Load documents
-    docs = []
-    for path in file_paths:
-        loader = PyMuPDFLoader(path)
-        loaded_docs = loader.load()
-        docs.extend(loaded_docs)
-        logger.info(f"Loaded {len(loaded_docs)} pages from {path}")
+def hash_file(path):
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    # Split documents
-    splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=200)
-    texts = splitter.split_documents(docs)
-    logger.info(f"Split into {len(texts)} chunks")
+def hash_content(text):
+    """SHA-256 of a chunk's text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-    # Create embeddings and store
-    return _store_documents_in_mongodb(texts, "pdf")
+def find_ingested_file(file_hash):
+    """Return the catalog record of an already ingested file with this hash, or None"""
+    return get_collection(SOURCES_COLLECTION).find_one({"file_hash": file_hash}, {"_id": 0})
+
+def ingest_file_chunks(path, file_hash, chunks, doc_type, on_progress=None):
+    """Store a file's chunks incrementally.
+
+    Chunks whose content hash is already stored for this source are kept as they
+    are, only new content is embedded, and stored chunks that no longer appear
+    in the file are removed. The file's catalog record in `sources` (size,
+    pages, chunk count, hash, timings) is refreshed at the end. Returns counts
+    of added/unchanged/removed chunks.
+    """
+    start = time.perf_counter()
+    started_at = datetime.now()
+    collection = get_collection()
+
+    # content hash -> ids of the chunks currently stored for this source
+    existing = {}
+    for doc in collection.find({"source": path}, {"content_hash": 1, "content": 1}):
+        content_hash = doc.get("content_hash") or hash_content(doc.get("content", ""))
+        existing.setdefault(content_hash, []).append(doc["_id"])
+
+    unchanged = 0
+    page_count = 0
+
+    def new_chunks():
+        nonlocal unchanged, page_count
+        for chunk in chunks:
+            page_count = max(page_count, chunk.metadata.get("total_pages", 0), chunk.metadata.get("page", -1) + 1)
+            ids = existing.get(hash_content(chunk.page_content))
+            if ids:
+                ids.pop()
+                unchanged += 1
+                continue
+            yield chunk
+
+    added = _store_documents_in_mongodb(
+        new_chunks(), doc_type, extra_fields={"file_hash": file_hash}, on_progress=on_progress
+    )
+
+    stale_ids = [doc_id for ids in existing.values() for doc_id in ids]
+    removed = _delete_chunks(collection, stale_ids) if stale_ids else 0
+
+    ingest_seconds = time.perf_counter() - start
+    get_collection(SOURCES_COLLECTION).update_one(
+        {"source": path},
+        {
+            "$set": {
+                "source": path,
+                "filename": os.path.basename(path),
+                "document_type": doc_type,
+                "file_hash": file_hash,
+                "byte_size": os.path.getsize(path),
+                "page_count": page_count,
+                "chunk_count": added + unchanged,
+                "ingest_started_at": started_at,
+                "ingest_seconds": round(ingest_seconds, 3),
+                "chunks_per_second": round(added / ingest_seconds, 1) if ingest_seconds > 0 else 0.0,
+                "updated_at": datetime.now(),
+            },
+            "$setOnInsert": {"created_at": started_at},
+        },
+        upsert=True
+    )
+
+    if added or removed:
+        get_snapshot_store().request_write(get_vector_index(), collection)
+
+    summary = {"added": added, "unchanged": unchanged, "removed": removed}
+    logger.info(f"Ingested {path}: {summary}")
+    return summary
 
 def load_json_data(uploaded_files):
     """Load JSON documents into MongoDB vectorstore"""
@@ -128,90 +210,308 @@ def load_json_data(uploaded_files):
     # Create embeddings and store
     return _store_documents_in_mongodb(texts, "json")
 
-def _store_documents_in_mongodb(texts, doc_type):
-    """Store documents in MongoDB with embeddings"""
-    # Create embeddings
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L12-v2")
+def _store_documents_in_mongodb(texts, doc_type, extra_fields=None, on_progress=None):
+    """Store documents in MongoDB with embeddings, embedding and inserting in batches.
+
+    `extra_fields` are added to every stored chunk; `on_progress(stage, count)`
+    is called with "embedded" and "inserted" as batches complete.
+    """
+    # Shared embedding model
+    embeddings = get_embeddings()
 
     # Get MongoDB collection
     collection = get_collection()
 
-    # Process and store documents
-    documents_to_insert = []
-    for i, doc in enumerate(texts):
-        embedding = embeddings.embed_query(doc.page_content)
-
-        doc_dict = {
-            "content": doc.page_content,
-            "source": doc.metadata.get("source", ""),
-            "page": doc.metadata.get("page", 0),
-            "document_type": doc_type,
-            "embeddings": embedding,
-            "created_at": time.time(),
-            "metadata": doc.metadata
-        }
-        documents_to_insert.append(doc_dict)
-
-    # Insert into MongoDB
-    if documents_to_insert:
-        result = collection.insert_many(documents_to_insert)
-        logger.info(f"Inserted {len(result.inserted_ids)} {doc_type} documents into MongoDB")
-
-    return len(documents_to_insert)
-
-def similarity_search(query, collection, embeddings_model, k=3):
-    """Perform similarity search in MongoDB"""
+    start = time.perf_counter()
+    inserted = 0
+    pending = None
+    pool = None
+    if EMBED_MULTI_PROCESS:
+        # One worker pool per upload instead of one per batch
+        pool = embeddings.client.start_multi_process_pool()
+
     try:
+        # Batch N is written on the writer thread while batch N+1 is encoded
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            for batch in _batched(texts, EMBED_BATCH_SIZE):
+                contents = [doc.page_content for doc in batch]
+                if pool is not None:
+                    vectors = embeddings.client.encode_multi_process(
+                        contents, pool, batch_size=EMBED_BATCH_SIZE
+                    ).tolist()
+                else:
+                    vectors = embeddings.embed_documents(contents)
+                if on_progress:
+                    on_progress("embedded", len(batch))
+
+                documents_to_insert = [
+                    {
+                        "content": doc.page_content,
+                        "source": doc.metadata.get("source", ""),
+                        "page": doc.metadata.get("page", 0),
+                        "document_type": doc_type,
+                        **encode_embedding(embedding),
+                        "content_hash": hash_content(doc.page_content),
+                        "created_at": time.time(),
+                        "metadata": doc.metadata,
+                        **(extra_fields or {})
+                    }
+                    for doc, embedding in zip(batch, vectors)
+                ]
+
+                if pending is not None:
+                    inserted += _wait_for_batch(pending, on_progress)
+                pending = writer.submit(_insert_batch, collection, documents_to_insert, vectors)
+
+            if pending is not None:
+                inserted += _wait_for_batch(pending, on_progress)
+    finally:
+        if pool is not None:
+            embeddings.client.stop_multi_process_pool(pool)
+
+    if inserted:
+        get_answer_cache().invalidate()
+
+    elapsed = time.perf_counter() - start
+    rate = inserted / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Inserted {inserted} {doc_type} documents into MongoDB "
+                f"in {elapsed:.2f}s ({rate:.1f} chunks/sec)")
+
+    return inserted
+
+def _batched(items, size):
+    """Yield successive lists of at most `size` items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _wait_for_batch(pending, on_progress):
+    """Wait for an in-flight insert and report it"""
+    count = pending.result()
+    if on_progress:
+        on_progress("inserted", count)
+    return count
+
+def _insert_batch(collection, documents_to_insert, vectors):
+    """Insert one batch of embedded chunks and add them to the vector index"""
+    result = collection.insert_many(documents_to_insert)
+    get_vector_index().add(result.inserted_ids, vectors)
+    get_bm25_index().add(result.inserted_ids, [doc["content"] for doc in documents_to_insert])
+    # insert_many has set `_id` on each document
+    get_metadata_index().add(documents_to_insert)
+    return len(result.inserted_ids)
+
+def delete_documents_by_source(filename, collection=None):
+    """Delete all chunks of a source file from MongoDB and the vector index"""
+    if collection is None:
+        collection = get_collection()
+
+    # Try exact match first
+    docs = list(collection.find({"source": filename}, {"_id": 1, "source": 1}))
+
+    # If no exact match, try matching documents that end with the filename
+    if not docs:
+        escaped_filename = re.escape(filename)
+        docs = list(collection.find(
+            {"source": {"$regex": f".*{escaped_filename}$", "$options": "i"}},
+            {"_id": 1, "source": 1}
+        ))
+
+    if not docs:
+        return 0
+
+    deleted_count = _delete_chunks(collection, [doc["_id"] for doc in docs])
+    sources = list({doc.get("source", "") for doc in docs})
+    get_collection(SOURCES_COLLECTION).delete_many({"source": {"$in": sources}})
+    get_snapshot_store().request_write(get_vector_index(), collection)
+    return deleted_count
+
+def _delete_chunks(collection, ids):
+    """Delete chunks by id from MongoDB and the vector index"""
+    result = collection.delete_many({"_id": {"$in": ids}})
+    get_vector_index().remove(ids)
+    get_bm25_index().remove(ids)
+    get_metadata_index().remove(ids)
+    get_answer_cache().invalidate()
+    return result.deleted_count
+
+def similarity_search(query, collection, embeddings_model, k=3, hybrid=False, candidates=20, filters=None,
+                      query_embedding=None, prior_ids=None):
+    """Perform similarity search against the in-process vector index.
+
+    With `hybrid`, the top `candidates` of the vector and BM25 rankings are
+    fused with reciprocal rank fusion before taking the top k. `filters`
+    (see metadata_index.normalize_filters) restrict scoring to the matching
+    chunks before any vector is compared. `query_embedding` overrides the
+    embedding of `query` (e.g. blended for a follow-up), and `prior_ids`
+    (chunks retrieved earlier in the conversation) replace weaker hits.
+    """
+    if query_embedding is None:
         logger.debug("Generating query embedding...")
-        query_embedding = embeddings_model.embed_query(query)
+        query_embedding = embed_query_cached(query, embeddings_model)
         logger.debug("Query embedding created")
 
-        # MongoDB aggregation pipeline for vector similarity search
-        logger.debug("Running similarity search in MongoDB...")
-        pipeline = [
-            {
-                "$addFields": {
-                    "similarity": {
-                        "$let": {
-                            "vars": {
-                                "dot_product": {
-                                    "$reduce": {
-                                        "input": {"$range": [0, {"$size": "$embeddings"}]},
-                                        "initialValue": 0,
-                                        "in": {
-                                            "$add": [
-                                                "$$value",
-                                                {
-                                                    "$multiply": [
-                                                        {"$arrayElemAt": ["$embeddings", "$$this"]},
-                                                        {"$arrayElemAt": [query_embedding, "$$this"]}
-                                                    ]
-                                                }
-                                            ]
+    try:
+        index = get_vector_index()
+        if not index.loaded:
+            load_vector_index(index, collection)
+        else:
+            get_snapshot_store().refresh(index)
+        _sync_side_indexes(index, collection)
+
+        ids = None
+        if filters:
+            metadata_index = get_metadata_index()
+            load_side_index(metadata_index, index, collection)
+            ids = metadata_index.match(filters)
+            logger.debug(f"Filters matched {len(ids)} chunks")
+            if not ids:
+                return []
+
+        if hybrid:
+            bm25 = get_bm25_index()
+            load_side_index(bm25, index, collection)
+            hits = hybrid_search(query, query_embedding, index, bm25, k, candidates, ids=ids)
+        else:
+            hits = index.search(query_embedding, k, ids=ids)
+        if prior_ids:
+            hits = _merge_prior_hits(hits, index, query_embedding, prior_ids, k, ids)
+        results = _fetch_hits(collection, hits)
+        logger.debug(f"Vector index search returned {len(results)} docs")
+        return results
+
+    except Exception as e:
+        logger.error(f"Error in vector index search, falling back to MongoDB: {e}")
+        return _mongo_similarity_search(query, query_embedding, collection, k, filters)
+
+_side_index_lock = threading.Lock()
+
+def load_side_index(side_index, index, collection):
+    """Build the metadata or BM25 index once (normally at startup); concurrent callers wait for that load"""
+    if side_index.loaded:
+        return
+    with _side_index_lock:
+        if not side_index.loaded:
+            side_index.load(collection)
+            side_index.synced_version = index.snapshot_version
+
+def _sync_side_indexes(index, collection):
+    """Apply chunk changes picked up through a new vector snapshot to the BM25 and metadata indexes.
+
+    Those indexes are only loaded once and then updated by this worker's own
+    ingests and deletes; when the vector index moves to a snapshot written by
+    another worker, they are diffed against its ids and the difference is
+    fetched from MongoDB.
+    """
+    version = index.snapshot_version
+    live_ids = None
+    for side_index in (get_metadata_index(), get_bm25_index()):
+        if side_index.loaded and side_index.synced_version != version:
+            if live_ids is None:
+                live_ids = index.ids()
+            side_index.sync(live_ids, collection)
+            side_index.synced_version = version
+
+def _merge_prior_hits(hits, index, query_embedding, prior_ids, k, allowed=None):
+    """Let previously retrieved chunks displace weaker hits; only their similarity is computed"""
+    seen = {doc_id for doc_id, _ in hits}
+    prior_ids = [
+        doc_id for doc_id in prior_ids
+        if doc_id not in seen and (allowed is None or doc_id in allowed)
+    ]
+    merged = list(hits)
+    for doc_id, similarity in sorted(
+        zip(prior_ids, index.similarities(prior_ids, query_embedding)),
+        key=lambda hit: hit[1] if hit[1] is not None else -1.0, reverse=True
+    ):
+        if similarity is None:
+            break
+        if len(merged) < k:
+            merged.append((doc_id, similarity))
+            continue
+        weakest = min(range(len(merged)), key=lambda i: merged[i][1])
+        if similarity <= merged[weakest][1]:
+            break
+        merged[weakest] = (doc_id, similarity)
+    return sorted(merged, key=lambda hit: hit[1], reverse=True)
+
+def _fetch_hits(collection, hits):
+    """Load the documents for (id, similarity) hits, preserving rank order"""
+    if not hits:
+        return []
+
+    projection = {"content": 1, "source": 1, "page": 1, "document_type": 1, "metadata": 1}
+    docs = {
+        doc["_id"]: doc
+        for doc in collection.find({"_id": {"$in": [doc_id for doc_id, _ in hits]}}, projection)
+    }
+
+    results = []
+    for doc_id, similarity in hits:
+        doc = docs.get(doc_id)
+        if doc is not None:
+            doc["similarity"] = similarity
+            results.append(doc)
+    return results
+
+def _mongo_similarity_search(query, query_embedding, collection, k=3, filters=None):
+    """Perform similarity search inside MongoDB (fallback when the index is unavailable)"""
+    results = []
+    try:
+        # Only documents still stored in the legacy array layout can be scored here
+        if collection.find_one({"embeddings": {"$exists": True}}, {"_id": 1}) is not None:
+            logger.debug("Running similarity search in MongoDB...")
+            pipeline = [
+                {"$match": {"embeddings": {"$exists": True}, **filters_to_mongo_query(filters)}},
+                {
+                    "$addFields": {
+                        "similarity": {
+                            "$let": {
+                                "vars": {
+                                    "dot_product": {
+                                        "$reduce": {
+                                            "input": {"$range": [0, {"$size": "$embeddings"}]},
+                                            "initialValue": 0,
+                                            "in": {
+                                                "$add": [
+                                                    "$$value",
+                                                    {
+                                                        "$multiply": [
+                                                            {"$arrayElemAt": ["$embeddings", "$$this"]},
+                                                            {"$arrayElemAt": [[float(x) for x in query_embedding], "$$this"]}
+                                                        ]
+                                                    }
+                                                ]
+                                            }
                                         }
                                     }
-                                }
-                            },
-                            "in": "$$dot_product"
+                                },
+                                "in": "$$dot_product"
+                            }
                         }
                     }
-                }
-            },
-            {"$sort": {"similarity": -1}},
-            {"$limit": k},
-            {"$project": {"content": 1, "source": 1, "page": 1, "document_type": 1, "similarity": 1, "metadata": 1}}
-        ]
-
-        results = list(collection.aggregate(pipeline))
-        logger.debug(f"Similarity search returned {len(results)} docs")
-        return results
+                },
+                {"$sort": {"similarity": -1}},
+                {"$limit": k},
+                {"$project": {"content": 1, "source": 1, "page": 1, "document_type": 1, "similarity": 1, "metadata": 1}}
+            ]
 
+            results = list(collection.aggregate(pipeline))
+            logger.debug(f"Similarity search returned {len(results)} docs")
     except Exception as e:
         logger.error(f"Error in similarity search: {e}")
-        # fallback: text search
-        results = list(collection.find(
-            {"$text": {"$search": query}},
-            {"score": {"$meta": "textScore"}}
-        ).sort([("score", {"$meta": "textScore"})]).limit(k))
-        logger.debug(f"Fallback text search returned {len(results)} docs")
-        return results
\ No newline at end of file
+    if results:
+        return results
+
+    # Text search when nothing could be scored by vector (e.g. all embeddings are packed)
+    results = list(collection.find(
+        {"$text": {"$search": query}, **filters_to_mongo_query(filters)},
+        {"score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"})]).limit(k))
+    logger.debug(f"Fallback text search returned {len(results)} docs")
+    return results
@@ -0,0 +1,176 @@
+import os
+import re
+import threading
+import time
+from logger import logger
+
+# Top-level chunk fields that can be filtered on; scalar keys of `metadata` are indexed as "metadata.<key>"
+FILTER_FIELDS = ("source", "document_type", "page")
+METADATA_PROJECTION = {field: 1 for field in FILTER_FIELDS} | {"metadata": 1}
+
+
+def normalize_filters(filters):
+    """Flatten filters to {field: condition}, with {"metadata": {"k": v}} becoming {"metadata.k": v}.
+
+    A condition is a value, a list of accepted values, or a range dict with
+    any of "gte", "gt", "lte", "lt".
+    """
+    flat = {}
+    for field, condition in (filters or {}).items():
+        if field == "metadata" and isinstance(condition, dict):
+            for key, value in condition.items():
+                flat[f"metadata.{key}"] = value
+        elif condition is not None:
+            flat[field] = condition
+    return flat
+
+
+def filters_to_mongo_query(filters):
+    """Equivalent MongoDB query for the fallback search path"""
+    query = {}
+    for field, condition in normalize_filters(filters).items():
+        if isinstance(condition, dict):
+            query[field] = {f"${op}": value for op, value in condition.items()}
+        elif isinstance(condition, list):
+            query[field] = {"$in": condition}
+        elif field == "source" and os.path.basename(condition) == condition:
+            # Match the bare filename against stored upload paths too
+            query[field] = {"$regex": f"(^|[/\\\\]){re.escape(condition)}$"}
+        else:
+            query[field] = condition
+    return query
+
+
+def _in_range(value, condition):
+    try:
+        return (
+            ("gte" not in condition or value >= condition["gte"]) and
+            ("gt" not in condition or value > condition["gt"]) and
+            ("lte" not in condition or value <= condition["lte"]) and
+            ("lt" not in condition or value < condition["lt"])
+        )
+    except TypeError:
+        return False
+
+
+class MetadataIndex:
+    """Posting lists from (field, value) to chunk ids, used to pre-filter retrieval.
+
+    Resolving a filter touches only the posting lists of the requested
+    values, so a query scoped to one report costs in proportion to that
+    report's chunks rather than the whole corpus.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        # Vector snapshot version this index was last brought in line with
+        self.synced_version = None
+        self._lock = threading.RLock()
+        self._reset()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, collection):
+        """Index the filterable fields of every chunk in MongoDB"""
+        start = time.perf_counter()
+        docs = list(collection.find({}, METADATA_PROJECTION))
+        with self._lock:
+            self._reset()
+            self._add(docs)
+            self.loaded = True
+        logger.info(f"Metadata index built over {len(docs)} chunks in {time.perf_counter() - start:.2f}s")
+
+    def add(self, docs):
+        """Index newly inserted chunk documents (they must carry `_id`)"""
+        with self._lock:
+            self._add(docs)
+
+    def sync(self, ids, collection):
+        """Bring the index in line with a set of live chunk ids, e.g. after another worker's ingest"""
+        with self._lock:
+            stale = set(self._keys) - ids
+            missing = ids.difference(self._keys)
+        docs = list(collection.find({"_id": {"$in": list(missing)}}, METADATA_PROJECTION)) if missing else []
+        with self._lock:
+            self.remove(stale)
+            self._add(doc for doc in docs if doc["_id"] not in self._keys)
+        if stale or docs:
+            logger.info(f"Metadata index synced: {len(docs)} chunks added, {len(stale)} removed")
+
+    def remove(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                for key in self._keys.pop(doc_id, ()):
+                    postings = self._postings.get(key)
+                    if postings is None:
+                        continue
+                    postings.discard(doc_id)
+                    if not postings:
+                        del self._postings[key]
+                        self._values[key[0]].discard(key[1])
+
+    def match(self, filters):
+        """Ids of the chunks matching every filter (AND across fields, OR within a list)"""
+        with self._lock:
+            matched = None
+            for field, condition in normalize_filters(filters).items():
+                if isinstance(condition, dict):
+                    values = [v for v in self._values.get(field, ()) if _in_range(v, condition)]
+                elif isinstance(condition, list):
+                    values = condition
+                else:
+                    values = [condition]
+
+                ids = set()
+                for value in values:
+                    ids |= self._postings.get((field, value), set())
+                # Intersect smallest-first so the cost follows the most selective filter
+                if matched is None or len(ids) < len(matched):
+                    matched, ids = ids, matched
+                if ids is not None:
+                    matched = matched & ids
+                if not matched:
+                    return set()
+            return matched if matched is not None else set(self._keys)
+
+    def _reset(self):
+        self._postings = {}
+        self._values = {}
+        self._keys = {}
+
+    def _add(self, docs):
+        for doc in docs:
+            keys = list(self._doc_keys(doc))
+            self._keys[doc["_id"]] = keys
+            for key in keys:
+                self._postings.setdefault(key, set()).add(doc["_id"])
+                self._values.setdefault(key[0], set()).add(key[1])
+
+    @staticmethod
+    def _doc_keys(doc):
+        for field in FILTER_FIELDS:
+            value = doc.get(field)
+            if value is None:
+                continue
+            yield field, value
+            if field == "source" and os.path.basename(value) != value:
+                # Uploads are stored by path; filters usually name just the file
+                yield field, os.path.basename(value)
+        for key, value in (doc.get("metadata") or {}).items():
+            if isinstance(value, (str, int, float, bool)):
+                yield f"metadata.{key}", value
+
+
+_metadata_index = None
+_metadata_index_lock = threading.Lock()
+
+
+def get_metadata_index():
+    """Get the process-wide metadata index"""
+    global _metadata_index
+    if _metadata_index is None:
+        with _metadata_index_lock:
+            if _metadata_index is None:
+                _metadata_index = MetadataIndex()
+    return _metadata_index
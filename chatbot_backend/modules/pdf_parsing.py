@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pymupdf
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from logger import logger
+
+load_dotenv()
+
+# 0 or 1 parses in-process; otherwise pages are fanned out over a process pool
+PDF_PARSE_WORKERS = int(os.environ.get("PDF_PARSE_WORKERS", os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 16))
+# Page-range results held in memory at once, regardless of upload size
+PDF_MAX_PENDING_TASKS = int(os.environ.get("PDF_MAX_PENDING_TASKS", 2 * max(PDF_PARSE_WORKERS, 1)))
+
+CHUNK_SIZE = 3000
+CHUNK_OVERLAP = 200
+
+
+def parse_page_range(path, start, end):
+    """Extract pages [start, end) of a PDF and split them into chunks.
+
+    Runs in a worker process; metadata mirrors what PyMuPDFLoader produces.
+    """
+    with pymupdf.open(path) as pdf:
+        file_metadata = {
+            key: value for key, value in (pdf.metadata or {}).items()
+            if isinstance(value, (str, int))
+        }
+        pages = [
+            Document(
+                page_content=pdf[i].get_text(),
+                metadata={
+                    "source": path,
+                    "file_path": path,
+                    "page": i,
+                    "total_pages": pdf.page_count,
+                    **file_metadata,
+                }
+            )
+            for i in range(start, end)
+        ]
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return end - start, splitter.split_documents(pages)
+
+
+def iter_pdf_chunks(paths):
+    """Yield (path, pages parsed, chunks) for each page range of each file, in order.
+
+    Page ranges of all files are parsed in parallel, but at most
+    PDF_MAX_PENDING_TASKS results are in flight, so memory stays bounded.
+    """
+    tasks = _page_range_tasks(paths)
+    if PDF_PARSE_WORKERS <= 1:
+        for path, start, end in tasks:
+            yield (path, *parse_page_range(path, start, end))
+        return
+
+    executor = _get_pool()
+    pending = deque()
+    for path, start, end in tasks:
+        pending.append((path, executor.submit(parse_page_range, path, start, end)))
+        if len(pending) >= PDF_MAX_PENDING_TASKS:
+            done_path, future = pending.popleft()
+            yield (done_path, *future.result())
+    while pending:
+        done_path, future = pending.popleft()
+        yield (done_path, *future.result())
+
+
+def _page_range_tasks(paths):
+    for path in paths:
+        with pymupdf.open(path) as pdf:
+            page_count = pdf.page_count
+        logger.info(f"Parsing {page_count} pages from {path}")
+        for start in range(0, page_count, PDF_PAGES_PER_TASK):
+            yield path, start, min(start + PDF_PAGES_PER_TASK, page_count)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: the parent holds the embedding model and threads, which do not fork safely
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pool
+
+
+def shutdown_pdf_pool():
+    """Stop the PDF parsing worker processes"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
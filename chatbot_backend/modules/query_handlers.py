@@ -1,90 +1,243 @@
+from modules.answer_cache import get_answer_cache, ANSWER_CACHE_ENABLED
+from modules.embedding_cache import embed_query_cached
+from modules.executor import run_blocking
+from modules.context_packing import pack_context
+from modules.single_flight import get_single_flight, request_key
+from modules.llm_limiter import get_llm_limiter, LLMOverloaded
+from modules.conversation_state import get_conversation_state
 from logger import logger
 
-def query_chain(chain_components, user_input: str):
-    """Process user query using hybrid approach (documents + general knowledge)"""
+def build_context(relevant_docs, question=None):
+    """Build the LLM context, the deduplicated source list and the context token count.
+
+    The most relevant sentences of the retrieved documents are packed into
+    CONTEXT_TOKEN_BUDGET; only documents that contributed text are cited.
+    """
+    context, used_docs, context_tokens = pack_context(question, relevant_docs)
+    sources = []
+    for doc in used_docs:
+        source = doc.get("source", "")
+        doc_type = doc.get("document_type", "document")
+        page = doc.get("page", 0) if doc.get("page") else ""
+
+        if source:
+            if doc_type == "pdf" and page:
+                source_info = f"{source} (page {page})"
+            elif doc_type == "json":
+                metadata = doc.get("metadata", {})
+                if metadata.get("key"):
+                    source_info = f"{source} (key: {metadata['key']})"
+                else:
+                    source_info = source
+            else:
+                source_info = source
+            sources.append(source_info)
+
+    return context, list(set(sources)), context_tokens  # deduplicate sources
+
+def _lookup_answer_cache(retriever, user_input, relevant_docs, query_embedding=None):
+    """Return (cached response or None, query embedding, source key)"""
+    if query_embedding is None:
+        query_embedding = embed_query_cached(user_input, retriever.embeddings_model)
+    source_key = frozenset(str(doc["_id"]) for doc in relevant_docs or [])
+    cached = get_answer_cache().lookup(query_embedding, source_key)
+    return cached, query_embedding, source_key
+
+def _chunk_ids(relevant_docs):
+    return [doc["_id"] for doc in relevant_docs or []]
+
+async def _resolve_conversation(retriever, user_input, session_id):
+    """Follow-up resolution against the session's recent turns (None if it fails)"""
     try:
-        logger.info(f"User input: {user_input}")
+        return await run_blocking(
+            get_conversation_state().resolve, session_id, user_input, retriever.embeddings_model
+        )
+    except Exception:
+        logger.exception("Could not resolve conversation context")
+        return None
 
+async def query_chain(chain_components, user_input: str, filters=None, session_id=None):
+    """Process user query using hybrid approach (documents + general knowledge)"""
+    logger.info(f"User input: {user_input}")
+    conversation = await _resolve_conversation(chain_components["retriever"], user_input, session_id)
+    response, chunk_ids = await _answer_question(chain_components, user_input, filters, conversation)
+    get_conversation_state().record(session_id, conversation, chunk_ids)
+    return response
+
+async def _answer_question(chain_components, user_input, filters, conversation):
+    """Retrieve and answer; returns (response, ids of the retrieved chunks)"""
+    # Follow-ups are asked together with the topic they refer to
+    question = conversation.question if conversation else user_input
+    try:
         document_chain = chain_components["document_chain"]
         general_chain = chain_components["general_chain"]
         retriever = chain_components["retriever"]
 
         # First, try to get relevant documents
         logger.debug("Starting document retrieval...")
-        relevant_docs = retriever.get_relevant_documents(user_input)
-        
+        cache_generation = get_answer_cache().generation
+        relevant_docs = await retriever.aget_relevant_documents(user_input, filters, conversation)
+
+        # Serve near-identical questions over the same sources from the answer cache
+        if ANSWER_CACHE_ENABLED:
+            cached, query_embedding, source_key = await run_blocking(
+                _lookup_answer_cache, retriever, question, relevant_docs,
+                conversation.query_embedding if conversation else None
+            )
+            if cached is not None:
+                logger.debug("Serving response from answer cache")
+                cached["cached"] = True
+                return cached, _chunk_ids(relevant_docs)
+
         if relevant_docs:
             # We have relevant documents, use document-based chain
             logger.debug(f"Found {len(relevant_docs)} relevant documents, using document-based response")
-            
+
             # Build context from documents
-            context = ""
-            sources = []
-            for doc in relevant_docs:
-                snippet = doc.get("content", "")[:800]  # Increased snippet size
-                context += snippet + "\n\n"
-                source = doc.get("source", "")
-                doc_type = doc.get("document_type", "document")
-                page = doc.get("page", 0) if doc.get("page") else ""
-                
-                if source:
-                    if doc_type == "pdf" and page:
-                        source_info = f"{source} (page {page})"
-                    elif doc_type == "json":
-                        metadata = doc.get("metadata", {})
-                        if metadata.get("key"):
-                            source_info = f"{source} (key: {metadata['key']})"
-                        else:
-                            source_info = source
-                    else:
-                        source_info = source
-                    sources.append(source_info)
+            context, sources, context_tokens = build_context(relevant_docs, question)
+            logger.debug(f"Packed {context_tokens} context tokens from {len(relevant_docs)} documents")
 
             logger.debug("Calling LLM with document context...")
-            # Use invoke method with the new chain
-            result = document_chain.invoke({"context": context, "question": user_input})
-            
+            # Use ainvoke so the event loop keeps serving other requests
+            result = await get_llm_limiter().ainvoke(document_chain, {"context": context, "question": question})
+
             # Extract content from AIMessage object
             response_text = result.content if hasattr(result, 'content') else str(result)
-            
+
             response = {
                 "response": response_text,
-                "sources": list(set(sources)),  # deduplicate
-                "response_type": "document_based"
+                "sources": sources,
+                "response_type": "document_based",
+                "context_tokens": context_tokens
             }
-            
+
         else:
             # No relevant documents found, use general knowledge
             logger.debug("No relevant documents found, using general knowledge response")
-            
+
             logger.debug("Calling LLM for general knowledge...")
-            result = general_chain.invoke({"question": user_input})
-            
+            result = await get_llm_limiter().ainvoke(general_chain, {"question": question})
+
             # Extract content from AIMessage object
             response_text = result.content if hasattr(result, 'content') else str(result)
-            
+
             response = {
                 "response": response_text,
                 "sources": [],
                 "response_type": "general_knowledge"
             }
 
+        if ANSWER_CACHE_ENABLED:
+            get_answer_cache().store(query_embedding, source_key, response, cache_generation)
+
+        response["cached"] = False
         logger.debug(f"Final response type: {response['response_type']}")
-        return response
+        return response, _chunk_ids(relevant_docs)
 
+    except LLMOverloaded:
+        # A fallback call would only add load to an LLM that is already saturated
+        raise
     except Exception as e:
         logger.exception("Error in query_chain")
         # Fallback to general knowledge in case of error
         try:
             logger.info("Attempting fallback to general knowledge...")
             general_chain = chain_components["general_chain"]
-            result = general_chain.invoke({"question": user_input})
+            result = await get_llm_limiter().ainvoke(general_chain, {"question": question})
             response_text = result.content if hasattr(result, 'content') else str(result)
             return {
                 "response": response_text,
                 "sources": [],
-                "response_type": "fallback_general"
-            }
+                "response_type": "fallback_general",
+                "cached": False
+            }, []
         except Exception as fallback_error:
             logger.exception("Fallback also failed")
-            raise e
\ No newline at end of file
+            raise e
+
+async def coalesced_query_chain(chain_components, user_input: str, filters=None, session_id=None):
+    """query_chain, with concurrent identical questions (same filters) sharing one computation.
+
+    Follow-ups depend on their session's history, so they only coalesce
+    within the same session.
+    """
+    logger.info(f"User input: {user_input}")
+    conversation = await _resolve_conversation(chain_components["retriever"], user_input, session_id)
+    key = request_key(user_input, filters)
+    if conversation is not None and conversation.follow_up:
+        key += (session_id,)
+    response, chunk_ids = await get_single_flight().run(
+        key, lambda: _answer_question(chain_components, user_input, filters, conversation)
+    )
+    get_conversation_state().record(session_id, conversation, chunk_ids)
+    return response
+
+async def stream_query_chain(chain_components, user_input: str, filters=None, session_id=None):
+    """Stream a query as events: sources first, then tokens, then the finished response.
+
+    Closing the generator (e.g. on client disconnect) closes the upstream
+    `astream` call, which cancels the Groq request.
+    """
+    logger.info(f"Streaming user input: {user_input}")
+
+    document_chain = chain_components["document_chain"]
+    general_chain = chain_components["general_chain"]
+    retriever = chain_components["retriever"]
+    query_embedding = None
+    conversation = await _resolve_conversation(retriever, user_input, session_id)
+    question = conversation.question if conversation else user_input
+
+    try:
+        cache_generation = get_answer_cache().generation
+        relevant_docs = await retriever.aget_relevant_documents(user_input, filters, conversation)
+        get_conversation_state().record(session_id, conversation, _chunk_ids(relevant_docs))
+
+        if ANSWER_CACHE_ENABLED:
+            cached, query_embedding, source_key = await run_blocking(
+                _lookup_answer_cache, retriever, question, relevant_docs,
+                conversation.query_embedding if conversation else None
+            )
+            if cached is not None:
+                cached["cached"] = True
+                yield {"type": "sources", "sources": cached["sources"], "response_type": cached["response_type"]}
+                yield {"type": "token", "content": cached["response"]}
+                yield {"type": "done", "response": cached}
+                return
+
+        context_tokens = 0
+        if relevant_docs:
+            context, sources, context_tokens = build_context(relevant_docs, question)
+            response_type = "document_based"
+            chain, inputs = document_chain, {"context": context, "question": question}
+        else:
+            sources = []
+            response_type = "general_knowledge"
+            chain, inputs = general_chain, {"question": question}
+    except Exception:
+        logger.exception("Error preparing streamed query, falling back to general knowledge")
+        context_tokens = 0
+        sources = []
+        response_type = "fallback_general"
+        chain, inputs = general_chain, {"question": question}
+
+    yield {"type": "sources", "sources": sources, "response_type": response_type}
+
+    parts = []
+    async for chunk in get_llm_limiter().astream(chain, inputs):
+        token = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        if token:
+            parts.append(token)
+            yield {"type": "token", "content": token}
+
+    response = {
+        "response": "".join(parts),
+        "sources": sources,
+        "response_type": response_type
+    }
+    if response_type == "document_based":
+        response["context_tokens"] = context_tokens
+    if ANSWER_CACHE_ENABLED and query_embedding is not None and response_type != "fallback_general":
+        get_answer_cache().store(query_embedding, source_key, response, cache_generation)
+
+    response["cached"] = False
+    yield {"type": "done", "response": response}
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL_NAME = os.environ.get("RERANK_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched from retrieval before reranking down to k
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", 20))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", 8))
+RERANK_TIME_BUDGET_MS = float(os.environ.get("RERANK_TIME_BUDGET_MS", 150))
+# Cross-encoders attend over the whole pair; longer chunk text is truncated anyway
+RERANK_MAX_CHARS = 2000
+# Per-pair cost estimate is lowered by this factor on each skip, so one slow batch cannot disable reranking for good
+SKIP_DECAY = 0.8
+
+
+class Reranker:
+    """Re-score retrieved chunks against the question with a cross-encoder.
+
+    `scorer` maps a list of (question, passage) pairs to relevance scores; by
+    default a sentence-transformers CrossEncoder is loaded on first use from
+    the local Hugging Face cache (no network access), and any callable can
+    stand in for it.
+
+    Pairs are scored in batches in retrieval order. A running estimate of the
+    per-pair cost decides, once the model is free, how many candidates fit in
+    what is left of the time budget (waiting for the model counts against
+    it), and no batch starts once it would run past the deadline;
+    candidates that were not scored keep their retrieval order behind the
+    scored ones. Every skipped request lowers the estimate a little, so after
+    a slow spell reranking is tried again and the estimate re-measured.
+    """
+
+    def __init__(self, scorer=None, model_name=RERANK_MODEL_NAME, batch_size=RERANK_BATCH_SIZE,
+                 time_budget_ms=RERANK_TIME_BUDGET_MS):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.time_budget_ms = time_budget_ms
+        self._scorer = scorer
+        self._lock = threading.Lock()
+        self._seconds_per_pair = None
+        self.requests = 0
+        self.skipped = 0
+        self.truncated = 0
+        self.pairs_scored = 0
+        self.total_seconds = 0.0
+
+    def rerank(self, question, docs, k, time_budget_ms=None):
+        """Return the top-k docs by cross-encoder score (each gets `rerank_score`)"""
+        budget = (self.time_budget_ms if time_budget_ms is None else time_budget_ms) / 1000
+        start = time.perf_counter()
+        deadline = start + budget
+
+        if not self._lock.acquire(timeout=max(budget, 0)):
+            # The model stayed busy for the whole budget (counters are best-effort here)
+            self.requests += 1
+            self.skipped += 1
+            return docs[:k]
+        try:
+            # Time spent waiting for the model counts against the budget
+            remaining = deadline - time.perf_counter()
+            scorer = self._get_scorer()
+            affordable = len(docs) if remaining > 0 else 0
+            if self._seconds_per_pair:
+                affordable = min(affordable, int(remaining / self._seconds_per_pair))
+            if affordable < min(k, len(docs)):
+                # Not even the top k can be rescored in time: keep retrieval order
+                self.requests += 1
+                self.skipped += 1
+                if self._seconds_per_pair and budget / self._seconds_per_pair < min(k, len(docs)):
+                    # Skipped on the estimate alone (not on queueing): let it recover
+                    self._seconds_per_pair *= SKIP_DECAY
+                return docs[:k]
+
+            scored = []
+            for batch_start in range(0, affordable, self.batch_size):
+                batch = docs[batch_start:min(batch_start + self.batch_size, affordable)]
+                batch_begun = time.perf_counter()
+                if self._seconds_per_pair and batch_begun + len(batch) * self._seconds_per_pair > deadline:
+                    break
+                scores = scorer([(question, doc.get("content", "")[:RERANK_MAX_CHARS]) for doc in batch])
+                self._observe(time.perf_counter() - batch_begun, len(batch))
+                for doc, score in zip(batch, scores):
+                    doc["rerank_score"] = float(score)
+                    scored.append(doc)
+
+            self.requests += 1
+            if not scored:
+                self.skipped += 1
+                return docs[:k]
+            self.truncated += len(scored) < len(docs)
+            self.total_seconds += time.perf_counter() - start
+        finally:
+            self._lock.release()
+
+        scored.sort(key=lambda doc: doc["rerank_score"], reverse=True)
+        return (scored + docs[len(scored):])[:k]
+
+    def warmup(self):
+        """Load the model and score one batch untimed, so the cold first call does not skew the estimate"""
+        start = time.perf_counter()
+        with self._lock:
+            self._get_scorer()([("warmup", "warmup")] * self.batch_size)
+        logger.info(f"Rerank model warmed up in {time.perf_counter() - start:.2f}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": RERANK_ENABLED,
+                "model_name": self.model_name,
+                "requests": self.requests,
+                "skipped_over_budget": self.skipped,
+                "partially_reranked": self.truncated,
+                "pairs_scored": self.pairs_scored,
+                "avg_ms": 1000 * self.total_seconds / max(self.requests - self.skipped, 1),
+                "ms_per_pair": 1000 * self._seconds_per_pair if self._seconds_per_pair else None,
+                "time_budget_ms": self.time_budget_ms,
+            }
+
+    def _observe(self, seconds, pairs):
+        per_pair = seconds / pairs
+        # Exponential moving average, so the estimate follows load on the host
+        self._seconds_per_pair = per_pair if self._seconds_per_pair is None else (
+            0.8 * self._seconds_per_pair + 0.2 * per_pair
+        )
+        self.pairs_scored += pairs
+
+    def _get_scorer(self):
+        if self._scorer is None:
+            from sentence_transformers import CrossEncoder
+            start = time.perf_counter()
+            model = CrossEncoder(self.model_name, local_files_only=True)
+            logger.info(f"Loaded rerank model {self.model_name} in {time.perf_counter() - start:.2f}s")
+            self._scorer = lambda pairs: model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        return self._scorer
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """Get the process-wide reranker"""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = Reranker()
+    return _reranker
@@ -0,0 +1,55 @@
+import asyncio
+import copy
+import json
+from modules.embedding_cache import normalize_query
+
+
+def request_key(question, filters=None):
+    """Key under which concurrent identical requests are coalesced"""
+    return normalize_query(question), json.dumps(filters or {}, sort_keys=True, default=str)
+
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent callers with the same key.
+
+    The first caller starts the computation as a task; callers arriving
+    while it runs await the same task. Each caller awaits it through
+    `asyncio.shield`, so a client that disconnects does not cancel the work
+    for the others. Every caller gets its own deep copy of the result.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key, make_coroutine):
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coroutine())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "upstream_calls": self.calls - self.coalesced,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """Get the process-wide single-flight group (one per event loop / worker)"""
+    return _single_flight
@@ -0,0 +1,46 @@
+import os
+import numpy as np
+from bson.binary import Binary
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# float16 (2 bytes/dim), int8 (1 byte/dim + a float32 scale) or array (legacy BSON doubles)
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "float16").lower()
+
+# Projection that covers both the packed and the legacy layout
+EMBEDDING_PROJECTION = {"embedding_bin": 1, "embedding_format": 1, "embeddings": 1}
+# Filter matching any document that carries an embedding
+HAS_EMBEDDING = {"$or": [{"embedding_bin": {"$exists": True}}, {"embeddings": {"$exists": True}}]}
+
+
+def encode_embedding(vector, storage=EMBEDDING_STORAGE):
+    """Return the document fields that store `vector` in the given format"""
+    vector = np.asarray(vector, dtype=np.float32)
+    if storage == "float16":
+        return {"embedding_bin": Binary(vector.astype(np.float16).tobytes()), "embedding_format": "float16"}
+    if storage == "int8":
+        peak = float(np.abs(vector).max())
+        scale = peak / 127 if peak > 0 else 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        payload = np.float32(scale).tobytes() + quantized.tobytes()
+        return {"embedding_bin": Binary(payload), "embedding_format": "int8"}
+    if storage == "array":
+        return {"embeddings": vector.tolist()}
+    raise ValueError(f"Unknown embedding storage format: {storage}")
+
+
+def decode_embedding(doc):
+    """Decode a stored embedding (packed or legacy array) into a float32 vector"""
+    payload = doc.get("embedding_bin")
+    if payload is None:
+        return np.asarray(doc["embeddings"], dtype=np.float32)
+
+    # frombuffer views the BSON bytes without copying; only the float32 upcast allocates
+    storage = doc.get("embedding_format", "float16")
+    if storage == "float16":
+        return np.frombuffer(payload, dtype=np.float16).astype(np.float32)
+    if storage == "int8":
+        scale = np.frombuffer(payload, dtype=np.float32, count=1)[0]
+        return np.frombuffer(payload, dtype=np.int8, offset=4).astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding storage format: {storage}")
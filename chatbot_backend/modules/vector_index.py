@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+import numpy as np
+from modules.vector_codec import decode_embedding, EMBEDDING_PROJECTION, HAS_EMBEDDING
+from logger import logger
+
+EMBEDDING_DIM = 384
+
+
+def normalize_vectors(vectors):
+    """Return float32 copies of the vectors scaled to unit L2 norm"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    """Exact cosine-similarity index over the chunk embeddings stored in MongoDB.
+
+    Vectors live in one contiguous float32 matrix with L2-normalized rows, so a
+    query is a single matrix-vector product followed by `argpartition`.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.loaded = False
+        # Snapshot the index was loaded from / last written to, and whether it changed since
+        self.snapshot_version = None
+        self.dirty = False
+        self._lock = threading.RLock()
+        self._reset()
+
+    def __len__(self):
+        return self._size
+
+    def load(self, collection):
+        """Load every stored embedding from MongoDB into the index"""
+        start = time.perf_counter()
+        ids, vectors = [], []
+        for doc in collection.find(HAS_EMBEDDING, EMBEDDING_PROJECTION):
+            ids.append(doc["_id"])
+            vectors.append(decode_embedding(doc))
+
+        with self._lock:
+            self._reset()
+            self._append(ids, vectors)
+            self.loaded = True
+            self.dirty = True
+
+        logger.info(f"Vector index loaded {len(ids)} embeddings in {time.perf_counter() - start:.2f}s")
+
+    def load_arrays(self, vectors, ids, snapshot_version=None, quantizer=None):
+        """Adopt an already-normalized matrix, e.g. a read-only memory map, without copying.
+
+        `quantizer` is the extra state exported by an approximate index; the
+        flat index has none and ignores it.
+        """
+        with self._lock:
+            self._reset()
+            self._buffer = vectors
+            self._size = len(ids)
+            self._ids = list(ids)
+            self._positions = {doc_id: pos for pos, doc_id in enumerate(self._ids)}
+            self.loaded = True
+            self.snapshot_version = snapshot_version
+            self.dirty = False
+
+    def export_arrays(self):
+        """Copy out (normalized vectors, ids, quantizer state or None) and mark the index as persisted"""
+        with self._lock:
+            self.dirty = False
+            return np.array(self._buffer[:self._size]), list(self._ids), None
+
+    def add(self, ids, vectors):
+        """Add newly inserted chunks to the index"""
+        with self._lock:
+            self._append(list(ids), vectors)
+            self.dirty = True
+
+    def remove(self, ids):
+        """Remove chunks from the index, keeping the matrix contiguous"""
+        removed = 0
+        with self._lock:
+            self._ensure_writable()
+            for doc_id in ids:
+                pos = self._positions.pop(doc_id, None)
+                if pos is None:
+                    continue
+                last = self._size - 1
+                if pos != last:
+                    # Move the last row into the freed slot
+                    moved_id = self._ids[last]
+                    self._buffer[pos] = self._buffer[last]
+                    self._ids[pos] = moved_id
+                    self._positions[moved_id] = pos
+                self._ids.pop()
+                self._size -= 1
+                removed += 1
+            self.dirty = self.dirty or removed > 0
+        return removed
+
+    def search(self, query_vector, k=3, ids=None):
+        """Return the top-k (id, similarity) pairs for a query embedding.
+
+        With `ids`, only those chunks are scored (pre-filtered search).
+        """
+        query = normalize_vectors(query_vector).reshape(-1)
+        with self._lock:
+            if ids is not None:
+                return self._search_subset(query, ids, k)
+            if self._size == 0:
+                return []
+            scores = self._buffer[:self._size] @ query
+            k = min(k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[i], float(scores[i])) for i in top]
+
+    def ids(self):
+        """Set of the chunk ids currently indexed"""
+        with self._lock:
+            return set(self._positions)
+
+    def similarities(self, ids, query_vector):
+        """Cosine similarity of specific chunks to a query embedding (None if not indexed)"""
+        query = normalize_vectors(query_vector).reshape(-1)
+        with self._lock:
+            return [
+                float(self._buffer[pos] @ query) if pos is not None else None
+                for pos in (self._positions.get(doc_id) for doc_id in ids)
+            ]
+
+    def _search_subset(self, query, ids, k):
+        positions = np.fromiter(
+            (pos for pos in map(self._positions.get, ids) if pos is not None), dtype=np.int64
+        )
+        if not len(positions):
+            return []
+        scores = self._buffer[positions] @ query
+        k = min(k, len(positions))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._ids[positions[i]], float(scores[i])) for i in top]
+
+    def _reset(self):
+        self._buffer = np.empty((0, self.dim), dtype=np.float32)
+        self._size = 0
+        self._ids = []
+        self._positions = {}
+
+    def _ensure_writable(self):
+        # Copy-on-write for matrices adopted from a read-only snapshot
+        if not self._buffer.flags.writeable:
+            self._buffer = np.array(self._buffer)
+
+    def _append(self, ids, vectors):
+        if not ids:
+            return
+        rows = normalize_vectors(vectors).reshape(-1, self.dim)
+        needed = self._size + len(ids)
+        if needed > len(self._buffer):
+            # Grow geometrically so repeated ingests stay amortized O(1) per row
+            capacity = max(needed, 2 * len(self._buffer), 1024)
+            buffer = np.empty((capacity, self.dim), dtype=np.float32)
+            buffer[:self._size] = self._buffer[:self._size]
+            self._buffer = buffer
+        self._buffer[self._size:needed] = rows
+        for offset, doc_id in enumerate(ids):
+            self._positions[doc_id] = self._size + offset
+        self._ids.extend(ids)
+        self._size = needed
+
+
+_vector_index = None
+_vector_index_lock = threading.Lock()
+
+
+def get_vector_index():
+    """Get the process-wide vector index (flat by default, IVF when VECTOR_INDEX_TYPE=ivf)"""
+    global _vector_index
+    if _vector_index is None:
+        with _vector_index_lock:
+            if _vector_index is None:
+                index_type = os.environ.get("VECTOR_INDEX_TYPE", "flat").lower()
+                if index_type == "ivf":
+                    from modules.ann_index import IVFIndex
+                    _vector_index = IVFIndex(
+                        nlist=int(os.environ["IVF_NLIST"]) if os.environ.get("IVF_NLIST") else None,
+                        nprobe=int(os.environ.get("IVF_NPROBE", 8))
+                    )
+                else:
+                    _vector_index = VectorIndex()
+                logger.info(f"Using {type(_vector_index).__name__} for vector search")
+    return _vector_index
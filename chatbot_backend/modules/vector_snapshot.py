@@ -0,0 +1,208 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from bson import ObjectId
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+SNAPSHOT_DIR = os.environ.get("VECTOR_SNAPSHOT_DIR", "./vector_snapshots")
+# Coalesce bursts of ingest/delete into one snapshot write
+SNAPSHOT_WRITE_DELAY = float(os.environ.get("VECTOR_SNAPSHOT_WRITE_DELAY", 2.0))
+# How often a worker checks whether another worker published a newer snapshot
+SNAPSHOT_CHECK_INTERVAL = float(os.environ.get("VECTOR_SNAPSHOT_CHECK_INTERVAL", 1.0))
+SNAPSHOT_KEEP = 2
+
+
+def encode_ids(ids):
+    """ObjectIds as an (n, 12) uint8 array (a bytes dtype would drop trailing NUL bytes)"""
+    return np.frombuffer(b"".join(doc_id.binary for doc_id in ids), dtype=np.uint8).reshape(-1, 12)
+
+
+def decode_ids(raw):
+    """Inverse of encode_ids; also reads snapshots that stored ids as NUL-stripped S12"""
+    if raw.dtype.kind == "S":
+        return [ObjectId(bytes(value).ljust(12, b"\0")) for value in raw]
+    return [ObjectId(row.tobytes()) for row in raw]
+
+
+class VectorSnapshotStore:
+    """Versioned on-disk snapshots of the vector index, shared by workers via mmap.
+
+    Each version is a directory holding `vectors.npy` (normalized float32 rows),
+    `ids.npy` (ObjectIds as rows of 12 uint8) and, for an IVF index,
+    `centroids.npy` and `assignment.npy` (list of each row), so adopting a
+    snapshot needs no k-means. `CURRENT` names the live version and is
+    replaced atomically, so readers never see a partially written snapshot.
+    Workers map the vectors read-only, so the page cache holds one copy
+    however many workers there are.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        self._last_check = 0.0
+
+    def current_version(self):
+        try:
+            return (self.directory / "CURRENT").read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def load(self, index, expected_count=None):
+        """Memory-map the current snapshot into the index; False if none is usable"""
+        version = self.current_version()
+        if version is None:
+            return False
+
+        start = time.perf_counter()
+        path = self.directory / version
+        try:
+            manifest = json.loads((path / "manifest.json").read_text())
+            if expected_count is not None and manifest["count"] != expected_count:
+                logger.info(f"Snapshot {version} has {manifest['count']} vectors, "
+                            f"collection has {expected_count}; ignoring it")
+                return False
+            vectors = np.load(path / "vectors.npy", mmap_mode="r")
+            ids = decode_ids(np.load(path / "ids.npy"))
+            quantizer = None
+            if (path / "centroids.npy").exists():
+                quantizer = {
+                    "centroids": np.load(path / "centroids.npy"),
+                    "assignment": np.load(path / "assignment.npy"),
+                    "trained_size": manifest.get("trained_size"),
+                }
+            index.load_arrays(vectors, ids, snapshot_version=version, quantizer=quantizer)
+        except Exception as e:
+            # A bad snapshot is never fatal: callers fall back to loading from MongoDB
+            logger.warning(f"Could not load vector snapshot {version}: {e}")
+            return False
+
+        logger.info(f"Mapped vector snapshot {version} ({len(ids)} vectors) "
+                    f"in {1000 * (time.perf_counter() - start):.1f}ms")
+        return True
+
+    def refresh(self, index):
+        """Pick up a snapshot published by another worker (throttled, skipped with local changes)"""
+        now = time.monotonic()
+        if now - self._last_check < SNAPSHOT_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        version = self.current_version()
+        if version is not None and version != index.snapshot_version and not index.dirty:
+            self.load(index)
+
+    def write(self, index, collection=None):
+        """Atomically publish the index as a new snapshot version"""
+        with self._exclusive():
+            current = self.current_version()
+            if current is not None and current != index.snapshot_version and collection is not None:
+                # Another worker published changes this index has not seen
+                logger.info(f"Snapshot {current} was written elsewhere, reloading index before writing")
+                index.load(collection)
+
+            start = time.perf_counter()
+            vectors, ids, quantizer = index.export_arrays()
+            version = f"v{time.time_ns()}"
+            staging = self.directory / f".{version}.tmp"
+            staging.mkdir()
+            np.save(staging / "vectors.npy", vectors)
+            np.save(staging / "ids.npy", encode_ids(ids))
+            manifest = {
+                "version": version,
+                "count": len(ids),
+                "dim": int(vectors.shape[1]) if vectors.ndim == 2 else index.dim,
+                "created_at": time.time(),
+            }
+            if quantizer is not None:
+                np.save(staging / "centroids.npy", quantizer["centroids"])
+                np.save(staging / "assignment.npy", quantizer["assignment"])
+                manifest["trained_size"] = int(quantizer["trained_size"])
+            (staging / "manifest.json").write_text(json.dumps(manifest))
+            os.rename(staging, self.directory / version)
+
+            pointer = self.directory / "CURRENT.tmp"
+            pointer.write_text(version)
+            os.replace(pointer, self.directory / "CURRENT")
+            index.snapshot_version = version
+            self._prune(version)
+            logger.info(f"Wrote vector snapshot {version} ({len(ids)} vectors) "
+                        f"in {time.perf_counter() - start:.2f}s")
+
+    def request_write(self, index, collection=None):
+        """Schedule a snapshot write after SNAPSHOT_WRITE_DELAY, coalescing repeated requests"""
+        with self._timer_lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(SNAPSHOT_WRITE_DELAY, self._flush, args=(index, collection))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write a pending snapshot now (used on shutdown)"""
+        with self._timer_lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            self._flush(*timer.args, clear_timer=False)
+
+    def _flush(self, index, collection, clear_timer=True):
+        if clear_timer:
+            with self._timer_lock:
+                self._timer = None
+        try:
+            self.write(index, collection)
+        except Exception as e:
+            logger.error(f"Error writing vector snapshot: {e}")
+
+    @contextmanager
+    def _exclusive(self):
+        # Serializes writers across worker processes
+        with open(self.directory / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _prune(self, current):
+        # Mapped files stay readable for workers still using them after unlink
+        versions = sorted(p for p in self.directory.iterdir() if p.is_dir() and p.name.startswith("v"))
+        for path in versions[:-SNAPSHOT_KEEP]:
+            if path.name != current:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    """Get the process-wide snapshot store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VectorSnapshotStore()
+    return _store
+
+
+def load_vector_index(index, collection):
+    """Map the latest snapshot if it matches the collection, else load from MongoDB and snapshot it"""
+    store = get_snapshot_store()
+    if store.load(index, expected_count=collection.estimated_document_count()):
+        return
+    index.load(collection)
+    try:
+        store.write(index)
+    except Exception as e:
+        logger.error(f"Error writing vector snapshot: {e}")
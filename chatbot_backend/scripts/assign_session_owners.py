@@ -0,0 +1,44 @@
+"""Give chat sessions without an owner to a user.
+
+Run from the chatbot_backend directory:
+
+    python -m scripts.assign_session_owners --owner <userId>
+    python -m scripts.assign_session_owners --owner <userId> --session <session_id> --session <session_id>
+    python -m scripts.assign_session_owners --owner <userId> --dry-run
+
+Sessions created before chats were scoped to users have no owner, so only
+anonymous callers (no bearer token) can see them. `--owner` is the userId
+in the backend's login tokens. Without `--session` every unowned session
+is assigned. Sessions that already have an owner are never changed.
+"""
+import argparse
+import time
+from modules.database import get_collection, create_indexes, CHAT_SESSIONS_COLLECTION
+from logger import logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owner", required=True, help="userId the sessions are given to")
+    parser.add_argument("--session", action="append", help="only this session (repeatable)")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    create_indexes()
+    sessions = get_collection(CHAT_SESSIONS_COLLECTION)
+    query = {"owner": None}
+    if args.session:
+        query["session_id"] = {"$in": args.session}
+
+    count = sessions.count_documents(query)
+    logger.info(f"{count} unowned chat sessions to assign to {args.owner}")
+    if args.dry_run or not count:
+        return
+
+    result = sessions.update_many(query, {"$set": {"owner": args.owner}})
+    logger.info(f"Assigned {result.modified_count} chat sessions in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Build the `sources` file catalog from the chunks already in MongoDB.
+
+Run from the chatbot_backend directory:
+
+    python -m scripts.backfill_sources
+    python -m scripts.backfill_sources --dry-run
+
+One aggregation over all chunks groups them by source; byte size, page
+count and hash are read from the uploaded file when it is still on disk.
+Catalog records without any chunks left are removed. Safe to re-run.
+"""
+import argparse
+import os
+import time
+import pymupdf
+from pymongo import UpdateOne
+from modules.database import get_collection, create_indexes, SOURCES_COLLECTION
+from modules.load_vectorstore import hash_file
+from logger import logger
+
+
+def local_time(object_id):
+    # ObjectId times are UTC-aware; the catalog stores naive local times like datetime.now()
+    return object_id.generation_time.astimezone().replace(tzinfo=None)
+
+
+def file_fields(path, doc_type, max_page):
+    fields = {"page_count": max_page + 1 if max_page is not None else 0}
+    if not os.path.isfile(path):
+        return fields
+    fields["byte_size"] = os.path.getsize(path)
+    fields["file_hash"] = hash_file(path)
+    if doc_type == "pdf":
+        with pymupdf.open(path) as pdf:
+            fields["page_count"] = pdf.page_count
+    return fields
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    create_indexes()
+    chunks = get_collection()
+    sources = get_collection(SOURCES_COLLECTION)
+    existing = {doc["source"]: doc for doc in sources.find({}, {"_id": 0})}
+
+    groups = chunks.aggregate([
+        {"$group": {
+            "_id": "$source",
+            "document_type": {"$first": "$document_type"},
+            "file_hash": {"$first": "$file_hash"},
+            "chunk_count": {"$sum": 1},
+            "max_page": {"$max": "$page"},
+            "first_id": {"$min": "$_id"},
+            "last_id": {"$max": "$_id"},
+        }}
+    ], allowDiskUse=True)
+
+    updates = []
+    seen = set()
+    for group in groups:
+        path = group["_id"]
+        if not path:
+            continue
+        seen.add(path)
+        record = existing.get(path, {})
+        fields = {
+            "source": path,
+            "filename": os.path.basename(path),
+            "document_type": group["document_type"],
+            "chunk_count": group["chunk_count"],
+            "byte_size": 0,
+            "file_hash": group["file_hash"] or record.get("file_hash"),
+            **file_fields(path, group["document_type"], group["max_page"]),
+            "updated_at": local_time(group["last_id"]),
+        }
+        created_at = record.get("created_at") or local_time(group["first_id"])
+        updates.append(UpdateOne({"source": path}, {"$set": {**fields, "created_at": created_at}}, upsert=True))
+
+    orphaned = [path for path in existing if path not in seen]
+    logger.info(f"{len(updates)} catalog records to write, {len(orphaned)} without chunks to remove")
+    if args.dry_run:
+        return
+
+    if updates:
+        sources.bulk_write(updates, ordered=False)
+    if orphaned:
+        sources.delete_many({"source": {"$in": orphaned}})
+    logger.info(f"Backfilled the source catalog in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Convert stored chunk embeddings to the packed binary format.
+
+Run from the chatbot_backend directory:
+
+    python -m scripts.migrate_embeddings                 # uses EMBEDDING_STORAGE (float16)
+    python -m scripts.migrate_embeddings --format int8 --dry-run
+
+Documents still holding a legacy `embeddings` array get `embedding_bin` /
+`embedding_format` and the array is removed. Already packed documents are
+re-encoded only with --repack. Safe to re-run after an interruption.
+"""
+import argparse
+import time
+from pymongo import UpdateOne
+from modules.database import get_collection, create_indexes
+from modules.vector_codec import encode_embedding, decode_embedding, EMBEDDING_STORAGE, EMBEDDING_PROJECTION
+from logger import logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", default=EMBEDDING_STORAGE, choices=["float16", "int8", "array"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--repack", action="store_true", help="also re-encode documents already in a packed format")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    collection = get_collection()
+    if args.repack:
+        query = {"embedding_format": {"$ne": args.format}, "$or": [
+            {"embedding_bin": {"$exists": True}}, {"embeddings": {"$exists": True}}
+        ]}
+    else:
+        query = {"embeddings": {"$exists": True}}
+    total = collection.count_documents(query)
+    logger.info(f"{total} documents to migrate to {args.format}")
+    if args.dry_run or not total:
+        return
+
+    start = time.perf_counter()
+    migrated = 0
+    batch = []
+    for doc in collection.find(query, EMBEDDING_PROJECTION):
+        fields = encode_embedding(decode_embedding(doc), args.format)
+        unset = {name: "" for name in EMBEDDING_PROJECTION if name not in fields}
+        update = {"$set": fields}
+        if unset:
+            update["$unset"] = unset
+        batch.append(UpdateOne({"_id": doc["_id"]}, update))
+        if len(batch) == args.batch_size:
+            migrated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+            logger.info(f"Migrated {migrated}/{total}")
+    if batch:
+        migrated += collection.bulk_write(batch, ordered=False).modified_count
+
+    # Also drops the old B-tree index on the embeddings array
+    create_indexes()
+    logger.info(f"Migrated {migrated} documents in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
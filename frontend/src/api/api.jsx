@@ -144,11 +144,22 @@ const chatbotApi = axios.create({
   timeout: 360000,
 });
 
+// Scope chat sessions to the logged-in user: the chatbot verifies the same token as the main API
+chatbotApi.interceptors.request.use((config) => {
+  const token = sessionStorage.getItem('token');
+  if (token) config.headers.Authorization = `Bearer ${token}`;
+  return config;
+}, Promise.reject);
+
 export const chatbotAPI = {
   testConnection: () => chatbotApi.get('/test'),
   createNewChat: (title = 'New Chat') => chatbotApi.post('/chat/new', { title }),
-  getChatSessions: () => chatbotApi.get('/chat/sessions'),
-  getChatSession: (id) => chatbotApi.get(`/chat/${id}`),
+  // `cursor` is the X-Next-Cursor header of the previous page
+  getChatSessions: (cursor = null) =>
+    chatbotApi.get('/chat/sessions', { params: cursor ? { cursor } : {} }),
+  // `before` is the next_cursor of a previous page, to load older messages
+  getChatSession: (id, before = null) =>
+    chatbotApi.get(`/chat/${id}`, { params: before !== null ? { before } : {} }),
   deleteChatSession: (id) => chatbotApi.delete(`/chat/${id}`),
   askQuestion: (question, sessionId = null) => {
     const fd = new FormData();
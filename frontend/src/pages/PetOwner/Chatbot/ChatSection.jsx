@@ -2,7 +2,10 @@ import React, { useState, useRef, useEffect } from 'react';
 import { Send, Bot, User, Sparkles } from 'lucide-react';
 import { chatbotAPI } from '../../../api/api';
 
-const ChatSection = ({ messages, onAddMessage, currentSessionId, onNewChat, loading, onMessageSent }) => {
+const ChatSection = ({
+  messages, onAddMessage, currentSessionId, onNewChat, loading, onMessageSent,
+  hasOlderMessages, loadingOlder, onLoadOlder
+}) => {
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const messagesEndRef = useRef(null);
@@ -12,9 +15,11 @@ const ChatSection = ({ messages, onAddMessage, currentSessionId, onNewChat, load
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  // Only new messages at the end scroll; loading earlier ones keeps the position
+  const lastMessage = messages[messages.length - 1];
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [lastMessage]);
 
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -128,6 +133,18 @@ const ChatSection = ({ messages, onAddMessage, currentSessionId, onNewChat, load
           </div>
         ) : (
           <div>
+            {hasOlderMessages && (
+              <div className="flex justify-center mb-6">
+                <button
+                  type="button"
+                  onClick={onLoadOlder}
+                  disabled={loadingOlder}
+                  className="px-4 py-2 text-sm text-purple-700 bg-purple-50 border border-purple-200 rounded-xl hover:bg-purple-100 disabled:opacity-50 disabled:cursor-not-allowed transition-colors"
+                >
+                  {loadingOlder ? 'Loading...' : 'Load earlier messages'}
+                </button>
+              </div>
+            )}
             {messages.map((message, index) => (
               <MessageBubble key={index} message={message} />
             ))}
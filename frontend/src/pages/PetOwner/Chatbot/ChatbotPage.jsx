@@ -10,6 +10,9 @@ function ChatbotApp({ setCurrentView }) {
   const [sidebarOpen, setSidebarOpen] = useState(false);
   const [adminPanelOpen, setAdminPanelOpen] = useState(false);
   const [currentSessionId, setCurrentSessionId] = useState(null);
+  // Cursor for the page of messages before the oldest one shown (null when all are loaded)
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [loading, setLoading] = useState(false);
   const [refreshTrigger, setRefreshTrigger] = useState(0);
   const [initialLoadDone, setInitialLoadDone] = useState(false);
@@ -28,6 +31,7 @@ function ChatbotApp({ setCurrentView }) {
 
   const clearChat = () => {
     setMessages([]);
+    setOlderCursor(null);
     setCurrentSessionId(null);
   };
 
@@ -49,6 +53,7 @@ function ChatbotApp({ setCurrentView }) {
       const response = await chatbotAPI.createNewChat('New Chat');
       const newSessionId = response.data.session_id;
       setMessages([]);
+      setOlderCursor(null);
       setCurrentSessionId(newSessionId);
       setRefreshTrigger((prev) => prev + 1);
 
@@ -76,6 +81,7 @@ function ChatbotApp({ setCurrentView }) {
       } else {
         setMessages([]);
       }
+      setOlderCursor(sessionData.next_cursor ?? null);
       
       setCurrentSessionId(sessionId);
       
@@ -85,12 +91,30 @@ function ChatbotApp({ setCurrentView }) {
     } catch (error) {
       console.error('Error loading session:', error);
       setMessages([]);
+      setOlderCursor(null);
       setCurrentSessionId(null);
     } finally {
       setLoading(false);
     }
   };
 
+  // Long chats are returned one page at a time, newest first
+  const handleLoadOlder = async () => {
+    if (olderCursor === null || loadingOlder) return;
+
+    setLoadingOlder(true);
+    try {
+      const response = await chatbotAPI.getChatSession(currentSessionId, olderCursor);
+      const older = Array.isArray(response.data.messages) ? response.data.messages : [];
+      setMessages((prev) => [...older, ...prev]);
+      setOlderCursor(response.data.next_cursor ?? null);
+    } catch (error) {
+      console.error('Error loading earlier messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   // When message is sent, refresh sidebar timestamps
   const handleMessageSent = () => {
     setRefreshTrigger((prev) => prev + 1);
@@ -151,6 +175,9 @@ function ChatbotApp({ setCurrentView }) {
                 onNewChat={handleNewChat}
                 loading={loading}
                 onMessageSent={handleMessageSent}
+                hasOlderMessages={olderCursor !== null}
+                loadingOlder={loadingOlder}
+                onLoadOlder={handleLoadOlder}
               />
             </div>
           </div>
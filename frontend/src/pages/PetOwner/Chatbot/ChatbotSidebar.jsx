@@ -22,6 +22,9 @@ const Sidebar = ({
 }) => {
   const [chatSessions, setChatSessions] = useState([]);
   const [loading, setLoading] = useState(false);
+  // Sessions come a page at a time; the cursor for the next one is in X-Next-Cursor
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [showDeleteMenu, setShowDeleteMenu] = useState(null);
   const [message, setMessage] = useState({ text: "", type: "" });
 
@@ -38,14 +41,31 @@ const Sidebar = ({
     try {
       const response = await chatbotAPI.getChatSessions();
       setChatSessions(response.data);
+      setNextCursor(response.headers["x-next-cursor"] || null);
     } catch (error) {
       console.error("Error fetching chat sessions:", error);
       setChatSessions([]);
+      setNextCursor(null);
     } finally {
       setLoading(false);
     }
   };
 
+  const fetchMoreSessions = async () => {
+    if (!nextCursor || loadingMore) return;
+
+    setLoadingMore(true);
+    try {
+      const response = await chatbotAPI.getChatSessions(nextCursor);
+      setChatSessions((prev) => [...prev, ...response.data]);
+      setNextCursor(response.headers["x-next-cursor"] || null);
+    } catch (error) {
+      console.error("Error fetching more chat sessions:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const deleteSession = async (sessionId) => {
     try {
       const confirmed = window.confirm("Are you sure you want to delete this chat?");
@@ -220,6 +240,15 @@ const Sidebar = ({
             </div>
           ))
         )}
+        {!loading && nextCursor && (
+          <button
+            onClick={fetchMoreSessions}
+            disabled={loadingMore}
+            className="w-full py-2 text-sm text-purple-700 hover:bg-purple-50 rounded-xl transition-all duration-200 disabled:opacity-50 disabled:cursor-not-allowed"
+          >
+            {loadingMore ? "Loading..." : "Load more"}
+          </button>
+        )}
       </div>
 
       {/* Footer */}